@@ -0,0 +1,146 @@
+"""Пропускная способность выдачи, продления и возврата: по одной книге и пакетами.
+
+По одной - маршруты admin_create_loan, extend_loan и admin_return_loan (запрос и
+транзакция на книгу); пакетами - /admin/loans/batch/checkout, extend и return
+(запрос и транзакция на пакет). Обе серии выдают одни и те же книги одним и тем же
+читателям и возвращают их, так что база после замера не меняется.
+
+    python -m benchmarks.circulation_batch --items 500 --batch-size 50
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+import sqlalchemy as sa
+
+from benchmarks.circulation_stress import login
+from benchmarks.routes import CREDENTIALS
+
+
+def pick_items(engine, count):
+    """Пары (читатель, книга) для выдачи: книги со свободными копиями, активные читатели"""
+    with engine.connect() as conn:
+        book_ids = conn.execute(sa.text(
+            'SELECT id FROM books WHERE available_copies > 0 ORDER BY id LIMIT :n'), {'n': count}).scalars().all()
+        reader_ids = conn.execute(sa.text(
+            "SELECT id FROM users WHERE is_active = 1 AND is_admin = 0 ORDER BY id")).scalars().all()
+    return [(reader_ids[i % len(reader_ids)], book_id) for i, book_id in enumerate(book_ids)]
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def one_by_one(client, items, due_date, extended_date):
+    loan_ids = []
+
+    def checkout():
+        for user_id, book_id in items:
+            response = client.post('/admin/loans/create', data={
+                'user_id': user_id, 'book_id': book_id, 'due_date': due_date})
+            assert response.status_code == 302
+
+    def extend():
+        for loan_id in loan_ids:
+            assert client.post(f'/admin/loans/{loan_id}/extend', json={'due_date': extended_date}).status_code == 200
+
+    def return_all():
+        for loan_id in loan_ids:
+            assert client.post(f'/admin/loans/{loan_id}/return').status_code == 302
+
+    timings = {'checkout': timed(checkout)}
+    loan_ids.extend(latest_loan_ids(len(items)))
+    timings['extend'] = timed(extend)
+    timings['return'] = timed(return_all)
+    return timings
+
+
+def batched(client, items, due_date, extended_date, batch_size):
+    loan_ids = []
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+    def checkout():
+        for batch in batches:
+            response = client.post('/admin/loans/batch/checkout', json={
+                'items': [{'user_id': user_id, 'book_id': book_id} for user_id, book_id in batch],
+                'due_date': due_date})
+            result = response.get_json()
+            assert result['failed'] == 0, result
+            loan_ids.extend(item['loan_id'] for item in result['results'])
+
+    def extend():
+        for i in range(0, len(loan_ids), batch_size):
+            response = client.post('/admin/loans/batch/extend', json={
+                'loan_ids': loan_ids[i:i + batch_size], 'due_date': extended_date})
+            assert response.get_json()['failed'] == 0
+
+    def return_all():
+        for i in range(0, len(loan_ids), batch_size):
+            response = client.post('/admin/loans/batch/return', json={'loan_ids': loan_ids[i:i + batch_size]})
+            assert response.get_json()['failed'] == 0
+
+    return {'checkout': timed(checkout), 'extend': timed(extend), 'return': timed(return_all)}
+
+
+def latest_loan_ids(count):
+    from data.db_models.db_session import get_engine
+
+    with get_engine().connect() as conn:
+        return conn.execute(sa.text('SELECT id FROM loans ORDER BY id DESC LIMIT :n'), {'n': count}).scalars().all()
+
+
+def run(db_file, items_count, batch_size):
+    from main import app
+    from data.db_models.db_session import global_init, get_engine
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    global_init(db_file)
+    items = pick_items(get_engine(), items_count)
+    client = login(app, *CREDENTIALS['admin'])
+    due_date = (date.today() + timedelta(days=14)).isoformat()
+    extended_date = (date.today() + timedelta(days=28)).isoformat()
+
+    single = one_by_one(client, items, due_date, extended_date)
+    batch = batched(client, items, due_date, extended_date, batch_size)
+    return [{
+        'operation': operation,
+        'items': len(items),
+        'batch_size': batch_size,
+        'single_items_per_sec': len(items) / single[operation],
+        'batch_items_per_sec': len(items) / batch[operation],
+        'speedup': single[operation] / batch[operation],
+    } for operation in ('checkout', 'extend', 'return')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Выдача, продление и возврат: по одной книге против пакетов')
+    parser.add_argument('--db', help='база данных (по умолчанию - синтетическая база масштаба 0.01)')
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--json', help='сохранить результаты в JSON-файл')
+    args = parser.parse_args()
+
+    db_file = args.db
+    if not db_file:
+        from data.scripts.generator import generate_dataset
+
+        fd, db_file = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        os.remove(db_file)
+        generate_dataset(db_file, 0.01, progress=lambda message: None)
+
+    results = run(db_file, args.items, args.batch_size)
+
+    print(f"{'operation':>10} {'items':>6} {'single/s':>10} {'batch/s':>10} {'speedup':>8}")
+    for result in results:
+        print(f"{result['operation']:>10} {result['items']:>6} {result['single_items_per_sec']:>10.1f} "
+              f"{result['batch_items_per_sec']:>10.1f} {result['speedup']:>7.1f}x")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,168 @@
+"""Проверка согласованности счетчиков копий при параллельных выдачах и резервациях.
+
+Несколько потоков одновременно резервируют (читатели), выдают, возвращают, выполняют
+и отменяют (администраторы) выдачи нескольких "горячих" книг с малым числом копий
+через маршруты main.py. После остановки для каждой книги проверяется:
+
+    available_copies >= 0, reserved_copies >= 0
+    reserved_copies = число ожидающих резерваций
+    total_copies - available_copies - reserved_copies = число выдач на руках
+    при непустой очереди на книгу свободных копий нет
+
+    python -m benchmarks.circulation_stress --threads 8 --seconds 10
+
+Код возврата 1, если счетчики какой-либо книги разошлись.
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+import sqlalchemy as sa
+
+from benchmarks.routes import CREDENTIALS
+
+ACTIONS = ('reserve', 'loan', 'return', 'fulfill', 'cancel')
+
+
+def prepare(engine, hot_books, copies):
+    """Сбрасывает выдачи и резервации первых hot_books книг; возвращает их id"""
+    with engine.begin() as conn:
+        book_ids = conn.execute(sa.text('SELECT id FROM books ORDER BY id LIMIT :n'), {'n': hot_books}).scalars().all()
+        params = [{'book_id': book_id, 'copies': copies} for book_id in book_ids]
+        conn.execute(sa.text('DELETE FROM loans WHERE book_id = :book_id'), params)
+        conn.execute(sa.text('DELETE FROM reservation WHERE book_id = :book_id'), params)
+        conn.execute(sa.text('UPDATE books SET total_copies = :copies, available_copies = :copies, '
+                             'reserved_copies = 0 WHERE id = :book_id'), params)
+    return book_ids
+
+
+def check(engine, book_ids):
+    """Книги с несогласованными счетчиками: список строк с описанием"""
+    problems = []
+    with engine.connect() as conn:
+        for book_id in book_ids:
+            total, available, reserved = conn.execute(sa.text(
+                'SELECT total_copies, available_copies, reserved_copies FROM books WHERE id = :id'),
+                {'id': book_id}).one()
+            on_loan = conn.execute(sa.text(
+                "SELECT COUNT(*) FROM loans WHERE book_id = :id AND status IN ('active', 'overdue')"),
+                {'id': book_id}).scalar()
+            pending = conn.execute(sa.text(
+                "SELECT COUNT(*) FROM reservation WHERE book_id = :id AND status = 'pending'"),
+                {'id': book_id}).scalar()
+            waiting = conn.execute(sa.text(
+                "SELECT COUNT(*) FROM reservation WHERE book_id = :id AND status = 'waiting'"),
+                {'id': book_id}).scalar()
+            if available < 0 or reserved < 0 or reserved != pending or total - available - reserved != on_loan \
+                    or (available > 0 and waiting):
+                problems.append(f'книга {book_id}: всего {total}, доступно {available}, зарезервировано '
+                                f'{reserved} (ожидающих резерваций {pending}), на руках {on_loan}, в очереди {waiting}')
+    return problems
+
+
+def login(app, email, password):
+    client = app.test_client()
+    if client.post('/login', data={'email': email, 'password': password}).status_code != 302:
+        raise RuntimeError(f'Не удалось войти как {email}')
+    return client
+
+
+def random_id(engine, query, book_ids):
+    with engine.connect() as conn:
+        ids = conn.execute(sa.text(query.format(ids=','.join(map(str, book_ids))))).scalars().all()
+    return random.choice(ids) if ids else None
+
+
+def run(db_file, threads, seconds, hot_books, copies):
+    from main import app
+    from data.db_models.db_session import global_init, get_engine
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    global_init(db_file)
+    engine = get_engine()
+    book_ids = prepare(engine, hot_books, copies)
+    with engine.connect() as conn:
+        reader_ids = conn.execute(sa.text(
+            "SELECT id FROM users WHERE email LIKE 'reader%' AND is_active = 1")).scalars().all()
+
+    admin_email, admin_password = CREDENTIALS['admin']
+    due_date = (date.today() + timedelta(days=14)).isoformat()
+    outcomes = Counter()
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def admin_worker():
+        client = login(app, admin_email, admin_password)
+        while not stop.is_set():
+            action = random.choice(ACTIONS[1:])
+            if action == 'loan':
+                response = client.post('/admin/loans/create', data={
+                    'user_id': random.choice(reader_ids), 'book_id': random.choice(book_ids), 'due_date': due_date})
+            elif action == 'return':
+                loan_id = random_id(engine, "SELECT id FROM loans WHERE book_id IN ({ids}) "
+                                            "AND status IN ('active', 'overdue')", book_ids)
+                if loan_id is None:
+                    continue
+                response = client.post(f'/admin/loans/{loan_id}/return')
+            else:
+                # Отменить можно и резервацию в очереди, выдать - только отложенную копию
+                statuses = "'pending'" if action == 'fulfill' else "'pending', 'waiting'"
+                reservation_id = random_id(engine, "SELECT id FROM reservation WHERE book_id IN ({ids}) "
+                                                   f"AND status IN ({statuses})", book_ids)
+                if reservation_id is None:
+                    continue
+                response = client.post(f'/admin/reservations/{reservation_id}/{action}')
+            with lock:
+                outcomes[action, response.status_code] += 1
+
+    def reader_worker():
+        reader_id = random.choice(reader_ids)
+        client = login(app, f'reader{reader_id}@library.ru', 'reader123')
+        while not stop.is_set():
+            response = client.post(f'/api/books/{random.choice(book_ids)}/reserve')
+            with lock:
+                outcomes['reserve', response.status_code] += 1
+
+    workers = [threading.Thread(target=admin_worker if i % 2 else reader_worker) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+
+    return outcomes, check(engine, book_ids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Параллельные выдачи и резервации: проверка счетчиков копий')
+    parser.add_argument('--db', help='база данных (по умолчанию - синтетическая база масштаба 0.01)')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--books', type=int, default=3, help='число "горячих" книг')
+    parser.add_argument('--copies', type=int, default=2, help='копий каждой книги')
+    args = parser.parse_args()
+
+    db_file = args.db
+    if not db_file:
+        from data.scripts.generator import generate_dataset
+
+        fd, db_file = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        os.remove(db_file)
+        generate_dataset(db_file, 0.01, progress=lambda message: None)
+
+    outcomes, problems = run(db_file, args.threads, args.seconds, args.books, args.copies)
+
+    for (action, status), count in sorted(outcomes.items()):
+        print(f'{action:>8} {status}: {count}')
+    for problem in problems:
+        print(f'Несогласованные счетчики: {problem}')
+    if not problems:
+        print('Счетчики копий согласованы')
+    raise SystemExit(1 if problems else 0)
@@ -0,0 +1,340 @@
+"""Нагрузочные замеры маршрутов main.py через app.test_client().
+
+Для каждого масштаба генерируется база (data.scripts.generator), затем в отдельном
+процессе каждый маршрут запрашивается от имени анонима, читателя или администратора.
+Для маршрута выводятся перцентили задержки, число SQL-запросов на запрос и пиковая
+память Python (tracemalloc) на один запрос. Результаты сохраняются в JSON; с
+--baseline новые результаты сравниваются с прошлым запуском и регрессии отмечаются.
+
+    python -m benchmarks.routes --scales 0.001 0.01 --iterations 30 --json bench.json
+    python -m benchmarks.routes --scales 0.001 0.01 --baseline bench.json
+    python -m benchmarks.routes --db db/database.db   # существующая база, один масштаб
+
+Число SQL-запросов маршрутов из QUERY_BUDGETS не должно превышать бюджет ни на
+одном масштабе: рост числа запросов вместе с числом строк означает N+1. При
+превышении бюджета или регрессии скрипт завершается с кодом 1.
+
+Изменяющие данные маршруты (POST) не замеряются: они меняли бы базу между итерациями.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from benchmarks.sqlite_profiles import percentile
+
+# (имя, клиент, URL); {user_id}, {book_id} и {loan_id} подставляются из базы
+ROUTES = [
+    ('index', 'anonymous', '/'),
+    ('catalog', 'anonymous', '/catalog'),
+    ('api_books', 'anonymous', '/api/books'),
+    ('api_books_deep_page', 'anonymous', '/api/books?page=100'),
+    ('api_books_filtered', 'anonymous', '/api/books?filter=available&sort=-year'),
+    ('api_books_query', 'anonymous', '/api/books?q=тайна'),
+    ('api_books_search', 'anonymous', '/api/books/search?q=тайна'),
+    ('api_suggest', 'anonymous', '/api/suggest?q=та'),
+    ('api_suggest_empty', 'anonymous', '/api/suggest'),
+    ('api_facets', 'anonymous', '/api/facets'),
+    ('login', 'anonymous', '/login'),
+    ('register', 'anonymous', '/register'),
+    ('profile', 'patron', '/profile'),
+    ('api_book_queue', 'patron', '/api/books/{book_id}/queue'),
+    ('admin_dashboard', 'admin', '/admin'),
+    ('admin_metrics', 'admin', '/admin/metrics'),
+    ('admin_metrics_prometheus', 'admin', '/admin/metrics/prometheus'),
+    ('admin_users', 'admin', '/admin/users'),
+    ('admin_users_search', 'admin', '/admin/users?search=иван'),
+    ('admin_user_detail', 'admin', '/admin/users/{user_id}'),
+    ('admin_loans', 'admin', '/admin/loans'),
+    ('admin_loans_returned', 'admin', '/admin/loans?status=returned'),
+    ('admin_create_loan', 'admin', '/admin/loans/create'),
+    ('admin_pick_users', 'admin', '/admin/api/users'),
+    ('admin_pick_users_search', 'admin', '/admin/api/users?q=иван'),
+    ('admin_pick_books', 'admin', '/admin/api/books'),
+    ('admin_pick_books_search', 'admin', '/admin/api/books?q=тайна'),
+    ('admin_loan_detail', 'admin', '/admin/loan/{loan_id}'),
+    ('admin_reservations', 'admin', '/admin/reservations'),
+    ('admin_books', 'admin', '/admin/books'),
+    ('admin_books_search', 'admin', '/admin/books?search=тайна'),
+    ('admin_book_detail', 'admin', '/admin/books/{book_id}'),
+    ('admin_edit_book', 'admin', '/admin/books/{book_id}/edit'),
+    ('admin_create_book', 'admin', '/admin/books/create'),
+    ('admin_export_loans', 'admin', '/admin/export/loans'),
+    ('admin_export_reservations', 'admin', '/admin/export/reservations?format=jsonl'),
+    ('admin_export_users', 'admin', '/admin/export/users'),
+    ('admin_export_books', 'admin', '/admin/export/books'),
+]
+# Наибольшее число SQL-запросов на запрос (после прогрева кэша пользователей)
+QUERY_BUDGETS = {
+    'index': 0,
+    'catalog': 0,
+    'api_books': 3,
+    'api_books_deep_page': 3,
+    'api_books_filtered': 3,
+    'api_books_query': 3,
+    'api_books_search': 2,
+    'api_suggest': 0,
+    'api_suggest_empty': 0,
+    'api_facets': 5,
+    'login': 0,
+    'register': 0,
+    'profile': 0,
+    'api_book_queue': 2,
+    'admin_dashboard': 7,
+    'admin_metrics': 0,
+    'admin_metrics_prometheus': 0,
+    'admin_users': 1,
+    'admin_users_search': 1,
+    'admin_user_detail': 6,
+    'admin_loans': 2,
+    'admin_loans_returned': 2,
+    'admin_create_loan': 0,
+    'admin_pick_users': 2,
+    'admin_pick_users_search': 2,
+    'admin_pick_books': 1,
+    'admin_pick_books_search': 1,
+    'admin_loan_detail': 2,
+    'admin_reservations': 3,
+    'admin_books': 4,
+    'admin_books_search': 4,
+    'admin_book_detail': 5,
+    'admin_edit_book': 1,
+    'admin_create_book': 0,
+    'admin_export_loans': 1,
+    'admin_export_reservations': 1,
+    'admin_export_users': 1,
+    'admin_export_books': 1,
+}
+CREDENTIALS = {
+    'admin': ('admin@library.ru', 'admin123'),
+    'patron': ('user@library.ru', 'user123'),
+}
+# Регрессия: p95 вырос больше чем в REGRESSION_RATIO раз или стало больше SQL-запросов
+REGRESSION_RATIO = 1.25
+
+
+class QueryCounter:
+    """Считает SQL-запросы всех движков (и записи, и чтения) через событие before_cursor_execute"""
+
+    def __init__(self):
+        self.count = 0
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def route_parameters(engine):
+    """Идентификаторы для маршрутов с параметрами: самые "тяжелые" читатель и книга"""
+    with engine.connect() as conn:
+        user_id = conn.execute(sa.text(
+            'SELECT reader_id FROM loans GROUP BY reader_id ORDER BY COUNT(*) DESC LIMIT 1')).scalar()
+        book_id = conn.execute(sa.text(
+            'SELECT book_id FROM loans GROUP BY book_id ORDER BY COUNT(*) DESC LIMIT 1')).scalar()
+        loan_id = conn.execute(sa.text(
+            "SELECT id FROM loans WHERE status != 'returned' ORDER BY id DESC LIMIT 1")).scalar()
+    return {'user_id': user_id or 1, 'book_id': book_id or 1, 'loan_id': loan_id or 1}
+
+
+def make_clients(app):
+    clients = {'anonymous': app.test_client()}
+    for role, (email, password) in CREDENTIALS.items():
+        client = app.test_client()
+        response = client.post('/login', data={'email': email, 'password': password})
+        if response.status_code != 302:
+            raise RuntimeError(f'Не удалось войти как {email}')
+        clients[role] = client
+    return clients
+
+
+def request_once(client, url):
+    response = client.get(url)
+    body = response.get_data()
+    response.close()
+    return response.status_code, len(body)
+
+
+def run_routes(db_file, iterations=20, warmup=2, routes=None):
+    """Замеряет маршруты на базе db_file в текущем процессе; возвращает список результатов"""
+    from main import app
+    from data.db_models.db_session import global_init, get_engine
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    global_init(db_file)
+    parameters = route_parameters(get_engine())
+    clients = make_clients(app)
+    counter = QueryCounter()
+
+    results = []
+    for name, role, url in ROUTES:
+        if routes and name not in routes:
+            continue
+        client = clients[role]
+        url = url.format(**parameters)
+
+        for _ in range(warmup):
+            request_once(client, url)
+
+        latencies, queries = [], []
+        status = size = None
+        for _ in range(iterations):
+            before = counter.count
+            start = time.perf_counter()
+            status, size = request_once(client, url)
+            latencies.append(time.perf_counter() - start)
+            queries.append(counter.count - before)
+
+        # Пиковая память замеряется отдельным запросом: tracemalloc сильно замедляет выполнение
+        tracemalloc.start()
+        request_once(client, url)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        results.append({
+            'route': name,
+            'client': role,
+            'url': url,
+            'status': status,
+            'bytes': size,
+            'iterations': iterations,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'mean_ms': sum(latencies) / len(latencies) * 1000,
+            'queries': max(queries),
+            'peak_kb': peak / 1024,
+        })
+    return results
+
+
+def dataset(data_dir, scale, seed):
+    """Файл базы для масштаба; сгенерированные базы переиспользуются между запусками"""
+    from data.scripts.generator import generate_dataset
+
+    path = os.path.join(data_dir, f'library-{scale:g}-{seed}.db')
+    if not os.path.exists(path):
+        print(f'Генерация базы масштаба {scale:g}...')
+        generate_dataset(path, scale, seed, progress=lambda message: None)
+    return path
+
+
+def run_in_subprocess(db_file, iterations, routes):
+    """Каждая база замеряется в своем процессе: чистые глобальные движки, кэши и память"""
+    fd, output = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        command = [sys.executable, '-m', 'benchmarks.routes', '--db', db_file,
+                   '--iterations', str(iterations), '--json', output, '--quiet']
+        if routes:
+            command += ['--routes', *routes]
+        # Код возврата 1 означает и превышение бюджета, поэтому успех проверяется по файлу результатов
+        process = subprocess.run(command, stdout=subprocess.DEVNULL)
+        if not os.path.getsize(output):
+            raise RuntimeError(f'Замер базы {db_file} завершился с ошибкой (код {process.returncode})')
+        with open(output, encoding='utf-8') as f:
+            return json.load(f)['results']
+    finally:
+        os.remove(output)
+
+
+def over_budget(results):
+    """Маршруты, превысившие бюджет SQL-запросов"""
+    return [f"{item['route']} (масштаб {item['scale']:g}): SQL-запросов {item['queries']}, "
+            f"бюджет {QUERY_BUDGETS[item['route']]}"
+            for item in results
+            if item['route'] in QUERY_BUDGETS and item['queries'] > QUERY_BUDGETS[item['route']]]
+
+
+def compare(results, baseline, ratio=REGRESSION_RATIO):
+    """Регрессии относительно прошлого запуска: список строк с описанием"""
+    previous = {(item['scale'], item['route']): item for item in baseline['results']}
+    regressions = []
+    for item in results:
+        old = previous.get((item['scale'], item['route']))
+        if not old:
+            continue
+        if old['p95_ms'] and item['p95_ms'] / old['p95_ms'] > ratio:
+            regressions.append(f"{item['route']} (масштаб {item['scale']:g}): p95 "
+                               f"{old['p95_ms']:.2f} -> {item['p95_ms']:.2f} мс")
+        if item['queries'] > old['queries']:
+            regressions.append(f"{item['route']} (масштаб {item['scale']:g}): SQL-запросов "
+                               f"{old['queries']} -> {item['queries']}")
+    return regressions
+
+
+def print_table(results, baseline=None):
+    previous = {(item['scale'], item['route']): item for item in (baseline or {}).get('results', [])}
+    columns = ['scale', 'route', 'status', 'p50_ms', 'p95_ms', 'p99_ms', 'queries', 'peak_kb']
+    header = ' '.join(f'{column:>24}' if column == 'route' else f'{column:>9}' for column in columns)
+    print(header + ('  p95 было' if previous else ''))
+    for item in results:
+        line = ' '.join(
+            f'{item[column]:>24}' if column == 'route'
+            else f'{item[column]:>9g}' if column == 'scale'
+            else f'{item[column]:>9.2f}' if isinstance(item[column], float)
+            else f'{item[column]:>9}' for column in columns)
+        old = previous.get((item['scale'], item['route']))
+        if old:
+            line += f"  {old['p95_ms']:>8.2f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замеры маршрутов приложения через тестовый клиент Flask')
+    parser.add_argument('--scales', type=float, nargs='+', default=[0.001, 0.01],
+                        help='масштабы синтетической базы (см. data.scripts.generator)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'library-benchmarks'),
+                        help='каталог для сгенерированных баз')
+    parser.add_argument('--db', help='замерить существующую базу в текущем процессе')
+    parser.add_argument('--iterations', type=int, default=20, help='запросов на маршрут')
+    parser.add_argument('--routes', nargs='+', help='только указанные маршруты')
+    parser.add_argument('--json', help='сохранить результаты в JSON-файл')
+    parser.add_argument('--baseline', help='JSON прошлого запуска для сравнения')
+    parser.add_argument('--quiet', action='store_true', help='не печатать таблицу')
+    args = parser.parse_args()
+
+    if args.db:
+        results = [{'scale': 0.0, **item} for item in run_routes(args.db, args.iterations, routes=args.routes)]
+    else:
+        os.makedirs(args.data_dir, exist_ok=True)
+        results = []
+        for scale in args.scales:
+            db_file = dataset(args.data_dir, scale, args.seed)
+            results += [{**item, 'scale': scale} for item in run_in_subprocess(db_file, args.iterations, args.routes)]
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlalchemy': sa.__version__,
+        'iterations': args.iterations,
+        'results': results,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    if not args.quiet:
+        print_table(results, baseline)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    failures = over_budget(results)
+    for failure in failures:
+        print(f'Превышен бюджет: {failure}')
+    if baseline:
+        regressions = compare(results, baseline)
+        for regression in regressions:
+            print(f'Регрессия: {regression}')
+        failures += regressions
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,217 @@
+"""Пропускная способность по HTTP: сервер разработки против prefork-запуска (wsgi.py).
+
+Каждый сервер запускается отдельным процессом на одной и той же базе:
+
+    dev      - main.create_app('development') и app.run(debug=True): один процесс,
+               поток на соединение, отладчик werkzeug
+    prefork  - python wsgi.py --workers N --threads T (ProductionConfig)
+
+Нагрузку создают несколько процессов-клиентов с потоками (всего --clients одновременных
+соединений), которые запрашивают анонимные маршруты из benchmarks.routes.ROUTES и
+/api/suggest. Для каждого сервера выводятся запросов в секунду, перцентили задержки и
+число ошибок (статус не 200 или сбой соединения).
+
+    python -m benchmarks.serving --workers 4 --threads 8 --clients 32 --seconds 10
+    python -m benchmarks.serving --db db/database.db --json serving.json
+
+Клиенты работают на той же машине, поэтому процессоров должно хватать и на них:
+на машине с одним ядром prefork не может дать прироста.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from urllib.parse import quote
+
+from benchmarks.routes import ROUTES, dataset
+from benchmarks.sqlite_profiles import percentile
+
+HOST = '127.0.0.1'
+URLS = [quote(url, safe='/?=&-') for name, client, url in ROUTES if client == 'anonymous'] + [
+    f'/api/suggest?q={quote("та")}']
+# Сколько ждать, пока сервер начнет отвечать
+STARTUP_TIMEOUT_SECONDS = 60
+
+DEV_SERVER = (
+    'import sys\n'
+    'from main import create_app\n'
+    'create_app("development").run(sys.argv[1], int(sys.argv[2]), debug=True, use_reloader=False)\n'
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, db_file, port, workers, threads):
+    """Процесс сервера kind ('dev' или 'prefork') на порту port"""
+    env = dict(os.environ, LIBRARY_DB=db_file, LIBRARY_SECRET_KEY='benchmark')
+    if kind == 'dev':
+        command = [sys.executable, '-c', DEV_SERVER, HOST, str(port)]
+    else:
+        command = [sys.executable, 'wsgi.py', '--host', HOST, '--port', str(port), '--workers', str(workers),
+                   '--threads', str(threads), '--no-scheduler']
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(process, port):
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Сервер завершился при запуске с кодом {process.returncode}')
+        try:
+            request(port, '/')
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('Сервер не ответил за отведенное время')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def request(port, url):
+    """GET url в новом соединении; статус ответа"""
+    conn = http.client.HTTPConnection(HOST, port, timeout=30)
+    try:
+        conn.request('GET', url)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def client_process(port, threads, seconds, seed, output):
+    """Процесс нагрузки: threads потоков запрашивают случайные URL в течение seconds"""
+    latencies, statuses = [], Counter()
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(rng):
+        local_latencies, local_statuses = [], Counter()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                status = request(port, rng.choice(URLS))
+            except OSError:
+                status = 'error'
+            local_latencies.append((time.perf_counter() - start) * 1000)
+            local_statuses[status] += 1
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+
+    workers = [threading.Thread(target=worker, args=(random.Random(seed * 1000 + i),)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    output.put((latencies, dict(statuses)))
+
+
+def run_load(port, clients, processes, seconds):
+    """Нагрузка из processes процессов на clients одновременных соединений; сводка"""
+    output = multiprocessing.Queue()
+    per_process = [clients // processes + (i < clients % processes) for i in range(processes)]
+    loaders = [multiprocessing.Process(target=client_process, args=(port, threads, seconds, i, output))
+               for i, threads in enumerate(per_process) if threads]
+    start = time.perf_counter()
+    for loader in loaders:
+        loader.start()
+    latencies, statuses = [], Counter()
+    for _ in loaders:
+        process_latencies, process_statuses = output.get()
+        latencies += process_latencies
+        statuses.update(process_statuses)
+    for loader in loaders:
+        loader.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'errors': sum(count for status, count in statuses.items() if status != 200),
+    }
+
+
+def measure(kind, db_file, workers, threads, clients, processes, seconds, warmup):
+    port = free_port()
+    server = start_server(kind, db_file, port, workers, threads)
+    try:
+        wait_ready(server, port)
+        # Прогрев: кэши SQLite, индекс подсказок и соединения пулов каждого процесса
+        run_load(port, clients, processes, warmup)
+        return {'server': kind, **run_load(port, clients, processes, seconds)}
+    finally:
+        stop_server(server)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Пропускная способность: сервер разработки и prefork-запуск')
+    parser.add_argument('--db', help='база данных (по умолчанию - синтетическая база масштаба --scale)')
+    parser.add_argument('--scale', type=float, default=0.01)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'library-benchmarks'),
+                        help='каталог для сгенерированных баз')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='рабочих процессов prefork')
+    parser.add_argument('--threads', type=int, default=8, help='потоков в рабочем процессе')
+    parser.add_argument('--clients', type=int, default=32, help='одновременных соединений')
+    parser.add_argument('--client-processes', type=int, default=2, help='процессов, создающих нагрузку')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2, help='секунд прогрева перед замером')
+    parser.add_argument('--servers', nargs='+', choices=('dev', 'prefork'), default=['dev', 'prefork'])
+    parser.add_argument('--json', help='сохранить результаты в JSON-файл')
+    args = parser.parse_args()
+
+    db_file = args.db
+    if not db_file:
+        os.makedirs(args.data_dir, exist_ok=True)
+        db_file = dataset(args.data_dir, args.scale, 42)
+
+    results = [measure(kind, db_file, args.workers, args.threads, args.clients, args.client_processes,
+                       args.seconds, args.warmup)
+               for kind in args.servers]
+
+    columns = ['server', 'requests', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'errors']
+    print(' '.join(f'{column:>9}' for column in columns))
+    for item in results:
+        print(' '.join(f'{item[column]:>9.1f}' if isinstance(item[column], float) else f'{item[column]:>9}'
+                       for column in columns))
+    by_server = {item['server']: item for item in results}
+    if by_server.keys() == {'dev', 'prefork'} and by_server['dev']['rps']:
+        print(f"prefork / dev: {by_server['prefork']['rps'] / by_server['dev']['rps']:.2f}x "
+              f"({args.workers} процессов по {args.threads} потоков, {os.cpu_count()} CPU)")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'cpus': os.cpu_count(),
+                'workers': args.workers,
+                'threads': args.threads,
+                'clients': args.clients,
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,147 @@
+"""Сравнение профилей SQLite из db_session.ENGINE_PROFILES.
+
+Несколько потоков читают страницы каталога через пул только для чтения, пока
+отдельный поток выдает книги (UPDATE books + INSERT loans). Для каждого профиля
+выводится пропускная способность чтения, перцентили задержек и число ошибок
+"database is locked".
+
+    python -m benchmarks.sqlite_profiles --books 20000 --readers 8 --seconds 5
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+import sqlalchemy as sa
+
+from data.db_models import __all_models  # noqa: F401 - регистрирует все таблицы
+from data.db_models.db_session import ENGINE_PROFILES, SqlAlchemyBase, create_engine
+
+PAGE_QUERY = sa.text(
+    'SELECT id, title, author, publication_year, publisher, genre, total_copies, available_copies '
+    'FROM books WHERE available_copies > 0 ORDER BY title, id LIMIT 6 OFFSET :offset'
+)
+COUNT_QUERY = sa.text('SELECT COUNT(*) FROM books WHERE available_copies > 0')
+LOAN_UPDATE = sa.text('UPDATE books SET available_copies = available_copies - 1 WHERE id = :book_id')
+LOAN_INSERT = sa.text(
+    "INSERT INTO loans (reader_id, book_id, loan_date, due_date, status) "
+    "VALUES (1, :book_id, :loan_date, :due_date, 'active')"
+)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def seed(db_file, books):
+    engine = create_engine(db_file, 'default')
+    SqlAlchemyBase.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            sa.text('INSERT INTO books (title, author, genre, publisher, publication_year, '
+                    'total_copies, available_copies, reserved_copies) '
+                    'VALUES (:title, :author, :genre, :publisher, :year, 1000000, 1000000, 0)'),
+            [{'title': f'Книга {i:07d}', 'author': f'Автор {i % 997}', 'genre': f'Жанр {i % 21}',
+              'publisher': f'Издательство {i % 31}', 'year': 1800 + i % 224} for i in range(books)]
+        )
+    engine.dispose()
+
+
+def run_profile(profile, books, readers, seconds):
+    fd, db_file = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        seed(db_file, books)
+        write_engine = create_engine(db_file, profile)
+        read_engine = create_engine(db_file, profile, read_only=True, pool_size=readers)
+
+        stop = threading.Event()
+        read_latencies, write_latencies = [], []
+        errors = {'read': 0, 'write': 0}
+        lock = threading.Lock()
+
+        def reader():
+            local = []
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    with read_engine.connect() as conn:
+                        conn.execute(COUNT_QUERY).scalar()
+                        conn.execute(PAGE_QUERY, {'offset': random.randrange(0, books // 2)}).all()
+                    local.append(time.perf_counter() - start)
+                except sa.exc.OperationalError:
+                    with lock:
+                        errors['read'] += 1
+            with lock:
+                read_latencies.extend(local)
+
+        def writer():
+            while not stop.is_set():
+                book_id = random.randint(1, books)
+                start = time.perf_counter()
+                try:
+                    with write_engine.begin() as conn:
+                        conn.execute(LOAN_UPDATE, {'book_id': book_id})
+                        conn.execute(LOAN_INSERT, {'book_id': book_id, 'loan_date': date.today(),
+                                                   'due_date': date.today() + timedelta(days=14)})
+                    write_latencies.append(time.perf_counter() - start)
+                except sa.exc.OperationalError:
+                    errors['write'] += 1
+
+        threads = [threading.Thread(target=reader) for _ in range(readers)] + [threading.Thread(target=writer)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        write_engine.dispose()
+        read_engine.dispose()
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+
+    return {
+        'profile': profile,
+        'reads_per_sec': len(read_latencies) / seconds,
+        'writes_per_sec': len(write_latencies) / seconds,
+        'read_p50_ms': percentile(read_latencies, 0.50) * 1000,
+        'read_p99_ms': percentile(read_latencies, 0.99) * 1000,
+        'write_p50_ms': percentile(write_latencies, 0.50) * 1000,
+        'write_p99_ms': percentile(write_latencies, 0.99) * 1000,
+        'write_mean_ms': statistics.mean(write_latencies) * 1000 if write_latencies else 0.0,
+        'read_errors': errors['read'],
+        'write_errors': errors['write'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сравнение профилей SQLite (чтение каталога при выдачах)')
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--json', help='сохранить результаты в JSON-файл')
+    args = parser.parse_args()
+
+    results = [run_profile(profile, args.books, args.readers, args.seconds) for profile in ENGINE_PROFILES]
+
+    columns = ['profile', 'reads_per_sec', 'read_p50_ms', 'read_p99_ms',
+               'writes_per_sec', 'write_p50_ms', 'write_p99_ms', 'read_errors', 'write_errors']
+    print(' '.join(f'{column:>14}' for column in columns))
+    for result in results:
+        print(' '.join(f'{result[column]:>14.2f}' if isinstance(result[column], float)
+                       else f'{result[column]:>14}' for column in columns))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
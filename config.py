@@ -0,0 +1,48 @@
+import os
+
+from data.db_models import db_session
+
+
+class Config:
+    """Общие настройки; значения можно переопределить переменными окружения LIBRARY_*"""
+    SECRET_KEY = os.environ.get('LIBRARY_SECRET_KEY', 'BE.shXML#QvZmqj"7b@n')
+    DEBUG = False
+    DB_FILE = os.environ.get('LIBRARY_DB', 'db/database.db')
+    DB_PROFILE = db_session.DEFAULT_PROFILE
+    # Пулы соединений одного процесса: пул чтения рассчитан на число его рабочих потоков
+    DB_POOL_SIZE = db_session.POOL_SIZE
+    DB_READ_POOL_SIZE = db_session.READ_POOL_SIZE
+    HOST = os.environ.get('LIBRARY_HOST', '127.0.0.1')
+    PORT = int(os.environ.get('LIBRARY_PORT', 500))
+    # Метрики запросов (/admin/metrics, /admin/metrics/prometheus); False - обработчики ничего не учитывают
+    METRICS_ENABLED = True
+    # Время жизни записей кэша пользователей load_user, секунд; 0 - кэш выключен
+    USER_CACHE_TTL = 300
+    # Фоновые задачи (просрочка выдач, истечение резерваций) - ровно в одном процессе
+    SCHEDULER_ENABLED = True
+
+
+class DevelopmentConfig(Config):
+    """Сервер разработки: отладчик werkzeug и перезагрузка при изменении кода"""
+    DEBUG = True
+
+
+class ProductionConfig(Config):
+    """Боевой запуск (wsgi.py): без отладчика, ключ сессий только из окружения"""
+    SECRET_KEY = os.environ.get('LIBRARY_SECRET_KEY')
+    HOST = os.environ.get('LIBRARY_HOST', '0.0.0.0')
+    PORT = int(os.environ.get('LIBRARY_PORT', 8000))
+    # Рабочих процессов и потоков в каждом
+    WORKERS = int(os.environ.get('LIBRARY_WORKERS', os.cpu_count() or 1))
+    THREADS = int(os.environ.get('LIBRARY_THREADS', 8))
+    DB_READ_POOL_SIZE = THREADS
+    # Кэш пользователей локален для процесса: блокировка пользователя или снятие прав
+    # администратора сбрасывают запись только в том процессе, который обработал запрос.
+    # С несколькими рабочими процессами кэш выключен, чтобы они действовали сразу везде
+    USER_CACHE_TTL = int(os.environ.get('LIBRARY_USER_CACHE_TTL', 0))
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+}
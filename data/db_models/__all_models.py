@@ -2,3 +2,4 @@ from . import books
 from . import loans
 from . import reservations
 from . import users
+from . import job_runs
@@ -0,0 +1,6 @@
+import sqlalchemy as sa
+
+
+def get_catalog_version(session):
+    """Текущая версия каталога; увеличивается триггерами при любом изменении книг (миграция 5)"""
+    return session.execute(sa.text('SELECT version FROM catalog_version WHERE id = 1')).scalar() or 0
@@ -1,33 +1,170 @@
+import os
+
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
 from sqlalchemy.orm import Session
 
 SqlAlchemyBase = orm.declarative_base()
 
+# Настройки пула соединений по умолчанию
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_TIMEOUT = 30
+# Отдельный пул только для чтения (GET-запросы каталога) рассчитан на число рабочих потоков
+READ_POOL_SIZE = 10
+READ_MAX_OVERFLOW = 20
+
+# Профили PRAGMA, выполняемых при открытии каждого соединения SQLite
+ENGINE_PROFILES = {
+    # Настройки SQLite по умолчанию: журнал отката, читатели и писатель блокируют друг друга
+    'default': {},
+    # WAL: чтение не блокируется записью; synchronous=NORMAL достаточно для WAL и не
+    # делает fsync на каждую транзакцию; ожидание блокировки вместо ошибки "database is locked"
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+        'temp_store': 'MEMORY',
+    },
+}
+DEFAULT_PROFILE = 'production'
+
 __factory = None
+__read_factory = None
+__engine = None
+__read_engine = None
+# Файл и настройки пулов, с которыми подключена база
+__settings = None
 
 
-def global_init(db_file):
-    global __factory
+def create_engine(db_file, profile=DEFAULT_PROFILE, read_only=False,
+                  pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT) -> sa.Engine:
+    """Движок SQLite с PRAGMA выбранного профиля; read_only запрещает запись (query_only)"""
+    conn_str = f'sqlite:///{db_file.strip()}?check_same_thread=False'
+    engine = sa.create_engine(conn_str, echo=False, poolclass=sa.pool.QueuePool,
+                              pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout)
 
-    if __factory:
-        return
+    pragmas = dict(ENGINE_PROFILES[profile])
+    if read_only:
+        pragmas['query_only'] = 'ON'
+
+    @sa.event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+    return engine
+
+
+def global_init(db_file, profile=DEFAULT_PROFILE, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                pool_timeout=POOL_TIMEOUT, read_pool_size=READ_POOL_SIZE, read_max_overflow=READ_MAX_OVERFLOW):
+    global __factory, __read_factory, __engine, __read_engine, __settings
 
     if not db_file or not db_file.strip():
         raise Exception("Необходимо указать файл базы данных.")
 
-    conn_str = f'sqlite:///{db_file.strip()}?check_same_thread=False'
-    print(f"Подключение к базе данных по адресу {conn_str}")
+    settings = (db_file.strip(), profile, pool_size, max_overflow, pool_timeout, read_pool_size, read_max_overflow)
+    if __factory:
+        # Движки одни на процесс: запросы продолжили бы работать с прежней базой и пулами
+        if settings != __settings:
+            raise Exception(f"База данных уже подключена с другими настройками: {__settings}, запрошено {settings}")
+        return
+
+    print(f"Подключение к базе данных {db_file.strip()} (профиль {profile})")
 
-    engine = sa.create_engine(conn_str, echo=False)
-    __factory = orm.sessionmaker(bind=engine)
+    engine = create_engine(db_file, profile, pool_size=pool_size, max_overflow=max_overflow,
+                           pool_timeout=pool_timeout)
+    __engine = engine
+    # Одна сессия на поток: в веб-приложении это сессия текущего запроса, которую
+    # закрывает remove_session() при завершении запроса
+    __factory = orm.scoped_session(orm.sessionmaker(bind=engine))
 
     # noinspection
     from . import __all_models
+    # Связи-backref (Loan.reader, Loan.book и др.) появляются на классах только после
+    # настройки мапперов; они нужны как атрибуты в joinedload/contains_eager
+    orm.configure_mappers()
 
     SqlAlchemyBase.metadata.create_all(engine)
 
+    from .migrations import migrate
+    migrate(engine)
+
+    from .search import init_search_index
+    init_search_index(engine)
+
+    __read_engine = create_engine(db_file, profile, read_only=True, pool_size=read_pool_size,
+                                  max_overflow=read_max_overflow, pool_timeout=pool_timeout)
+    __read_factory = orm.scoped_session(orm.sessionmaker(bind=__read_engine))
+    __settings = settings
+
+
+def get_engine() -> sa.Engine:
+    global __engine
+    return __engine
+
 
 def create_session() -> Session:
+    """Сессия текущего запроса (потока): повторные вызовы возвращают ту же сессию"""
     global __factory
     return __factory()
+
+
+def create_read_session() -> Session:
+    """Сессия текущего запроса для пула только для чтения (GET-запросы, не изменяющие данные)"""
+    global __read_factory
+    return __read_factory()
+
+
+def remove_session():
+    """Закрывает сессии текущего запроса, откатывая незавершенную транзакцию"""
+    global __factory, __read_factory
+    for factory in (__factory, __read_factory):
+        if factory:
+            factory.remove()
+
+
+def dispose_engines(close=True):
+    """Сбрасывает пулы соединений обоих движков; новые соединения откроются при следующем запросе.
+
+    close=False - для дочернего процесса после fork: соединения SQLite, унаследованные
+    от родителя, нельзя ни использовать, ни закрывать из ребенка, поэтому пулы просто
+    заменяются пустыми, а сессии потоков родителя забываются без закрытия.
+    """
+    global __engine, __read_engine, __factory, __read_factory
+    for engine in (__engine, __read_engine):
+        if engine:
+            engine.dispose(close=close)
+    for factory in (__factory, __read_factory):
+        if factory:
+            factory.registry.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    # Движки создаются один раз в родителе (там же выполняются миграции), а каждый рабочий
+    # процесс prefork-сервера открывает собственные соединения
+    os.register_at_fork(after_in_child=lambda: dispose_engines(close=False))
+
+
+def _pool_stats(engine):
+    pool = engine.pool
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+        'timeout': pool.timeout(),
+    }
+
+
+def pool_stats():
+    """Состояние пулов соединений (запись и чтение): размер, свободные, выданные и сверх лимита"""
+    global __engine, __read_engine
+    return {
+        'write': _pool_stats(__engine),
+        'read': _pool_stats(__read_engine),
+    }
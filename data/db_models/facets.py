@@ -0,0 +1,96 @@
+import sqlalchemy as sa
+
+
+# Счетчики фасетов каталога: сколько книг (и сколько из них со свободными копиями) у
+# каждого жанра, автора, издательства и десятилетия издания. Таблица поддерживается
+# триггерами на books, поэтому создание, правка и удаление книги, а также выдачи и
+# возвраты, меняющие доступность, обновляют по одной строке на фасет без GROUP BY.
+FACETS_TABLE = 'book_facets'
+
+# Фасет -> значение фасета для строки books ({row} - new или old)
+FACETS = {
+    'genre': '{row}.genre',
+    'author': '{row}.author',
+    'publisher': '{row}.publisher',
+    # Десятилетие - первый год: '1990'
+    'decade': 'CAST({row}.publication_year / 10 * 10 AS TEXT)',
+}
+
+# Колонки books, от которых зависят счетчики
+_watched = ', '.join(['genre', 'author', 'publisher', 'publication_year', 'available_copies'])
+
+
+def _value(facet, row):
+    return FACETS[facet].format(row=row)
+
+
+def _add(facet, row, sign):
+    """Команды триггера: учесть книгу row в фасете facet со знаком sign (+1 или -1)"""
+    value = _value(facet, row)
+    available = f'({row}.available_copies > 0)'
+    if sign > 0:
+        return [
+            f"INSERT INTO {FACETS_TABLE} (facet, value, books, available) "
+            f"SELECT '{facet}', {value}, 1, {available} WHERE {value} IS NOT NULL AND {value} != '' "
+            f"ON CONFLICT (facet, value) DO UPDATE SET books = books + 1, available = available + excluded.available;"
+        ]
+    return [
+        f"UPDATE {FACETS_TABLE} SET books = books - 1, available = available - {available} "
+        f"WHERE facet = '{facet}' AND value = {value};",
+        f"DELETE FROM {FACETS_TABLE} WHERE facet = '{facet}' AND value = {value} AND books <= 0;",
+    ]
+
+
+def _body(*parts):
+    return '\n'.join(statement for facet in FACETS for row, sign in parts for statement in _add(facet, row, sign))
+
+
+# Строка books изменилась для фасетов: поменялось значение фасета или доступность книги
+_changed = ' OR '.join(
+    [f'({_value(facet, "old")}) IS NOT ({_value(facet, "new")})' for facet in FACETS]
+    + ['(old.available_copies > 0) IS NOT (new.available_copies > 0)']
+)
+
+FACETS_DDL = (
+    f"""CREATE TABLE IF NOT EXISTS {FACETS_TABLE} (
+        facet VARCHAR NOT NULL, value VARCHAR NOT NULL,
+        books INTEGER NOT NULL, available INTEGER NOT NULL,
+        PRIMARY KEY (facet, value)
+    )""",
+    # Первые N значений фасета по числу книг
+    f'CREATE INDEX IF NOT EXISTS ix_{FACETS_TABLE}_facet_books ON {FACETS_TABLE} (facet, books)',
+    f"""CREATE TRIGGER IF NOT EXISTS {FACETS_TABLE}_ai AFTER INSERT ON books BEGIN
+        {_body(('new', 1))}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FACETS_TABLE}_ad AFTER DELETE ON books BEGIN
+        {_body(('old', -1))}
+    END""",
+    # Выдачи и возвраты меняют available_copies, но счетчики затрагивают, только когда
+    # книга становится доступной или недоступной
+    f"""CREATE TRIGGER IF NOT EXISTS {FACETS_TABLE}_au AFTER UPDATE OF {_watched} ON books
+        WHEN {_changed} BEGIN
+        {_body(('old', -1), ('new', 1))}
+    END""",
+)
+
+
+def rebuild_facets(conn):
+    """Пересчитывает счетчики фасетов по всей таблице books"""
+    conn.execute(sa.text(f'DELETE FROM {FACETS_TABLE}'))
+    for facet in FACETS:
+        value = _value(facet, 'books')
+        conn.execute(sa.text(
+            f"INSERT INTO {FACETS_TABLE} (facet, value, books, available) "
+            f"SELECT '{facet}', {value}, COUNT(*), SUM(available_copies > 0) FROM books "
+            f"WHERE {value} IS NOT NULL AND {value} != '' GROUP BY {value}"
+        ))
+
+
+def top_facets(session, facets=tuple(FACETS), limit=10):
+    """Первые limit значений каждого фасета по числу книг: {фасет: [(значение, книг, доступных), ...]}"""
+    statement = sa.text(
+        f'SELECT value, books, available FROM {FACETS_TABLE} WHERE facet = :facet '
+        f'ORDER BY books DESC, value LIMIT :limit'
+    )
+    return {facet: [tuple(row) for row in session.execute(statement, {'facet': facet, 'limit': limit})]
+            for facet in facets}
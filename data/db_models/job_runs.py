@@ -0,0 +1,17 @@
+import sqlalchemy as sa
+from sqlalchemy_serializer import SerializerMixin
+
+from .db_session import SqlAlchemyBase
+
+
+class JobRun(SqlAlchemyBase, SerializerMixin):
+    """Журнал запусков фоновых задач: время выполнения и число обработанных строк"""
+    __tablename__ = 'job_runs'
+
+    id = sa.Column(sa.Integer,
+                   primary_key=True, autoincrement=True)
+    job_name = sa.Column(sa.String, index=True)
+    started_at = sa.Column(sa.DateTime)
+    duration_ms = sa.Column(sa.Float)
+    rows_affected = sa.Column(sa.Integer, default=0)
+    error = sa.Column(sa.String)
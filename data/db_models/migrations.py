@@ -0,0 +1,195 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from .facets import FACETS_DDL, rebuild_facets
+from .users import fold_search_text, search_name_columns
+
+
+def add_missing_columns(table, columns):
+    """Шаг миграции: добавляет колонки, которых нет в таблице (базы, созданные старой схемой)"""
+    def step(conn):
+        existing = {row[1] for row in conn.execute(sa.text(f'PRAGMA table_info({table})'))}
+        for name, definition in columns:
+            if name not in existing:
+                conn.execute(sa.text(f'ALTER TABLE {table} ADD COLUMN {name} {definition}'))
+    return step
+
+
+def drop_reservation_unique_constraint(conn):
+    """Пересоздает таблицу reservation без UNIQUE (reader_id, book_id) из старой схемы:
+    SQLite не умеет удалять ограничения, поэтому данные копируются в новую таблицу"""
+    indexes = conn.execute(sa.text('PRAGMA index_list(reservation)')).all()
+    if not any(index[3] == 'u' for index in indexes):
+        return
+    conn.execute(sa.text(
+        'CREATE TABLE reservation_new ('
+        'id INTEGER NOT NULL, reader_id INTEGER, book_id INTEGER, reservation_date DATE, status VARCHAR, '
+        'PRIMARY KEY (id), '
+        'FOREIGN KEY(reader_id) REFERENCES users (id), FOREIGN KEY(book_id) REFERENCES books (id))'
+    ))
+    conn.execute(sa.text(
+        'INSERT INTO reservation_new (id, reader_id, book_id, reservation_date, status) '
+        'SELECT id, reader_id, book_id, reservation_date, status FROM reservation'
+    ))
+    conn.execute(sa.text('DROP TABLE reservation'))
+    conn.execute(sa.text('ALTER TABLE reservation_new RENAME TO reservation'))
+
+
+def copy_legacy_admin_flag(conn):
+    """В старой схеме флаг администратора хранился в колонке users.admin"""
+    existing = {row[1] for row in conn.execute(sa.text('PRAGMA table_info(users)'))}
+    if 'admin' in existing:
+        conn.execute(sa.text('UPDATE users SET is_admin = admin WHERE admin IS NOT NULL'))
+
+
+def fill_user_search_columns(conn):
+    """Заполняет колонки поиска пользователей: нормализация выполняется в Python,
+    потому что lower() в SQLite меняет регистр только латиницы"""
+    rows = conn.execute(sa.text('SELECT id, full_name, email FROM users')).all()
+    params = []
+    for user_id, full_name, email in rows:
+        search_name, search_given_name = search_name_columns(full_name)
+        params.append({'id': user_id, 'search_name': search_name, 'search_given_name': search_given_name,
+                       'search_email': fold_search_text(email)})
+    if params:
+        conn.execute(sa.text(
+            'UPDATE users SET search_name = :search_name, search_given_name = :search_given_name, '
+            'search_email = :search_email WHERE id = :id'
+        ), params)
+
+
+# Версионированные миграции схемы, только вперед. Каждая миграция - список SQL-команд
+# или функций conn -> None; применяется в отдельной транзакции вместе с записью в
+# schema_migrations. Новые миграции добавляются в конец списка со следующим номером,
+# уже выпущенные миграции не изменяются.
+MIGRATIONS = [
+    (1, 'Колонки, отсутствующие в базах старой схемы', [
+        add_missing_columns('users', [
+            ('is_admin', 'INTEGER DEFAULT 0'),
+            ('is_active', 'INTEGER DEFAULT 1'),
+            ('created_at', 'DATETIME'),
+        ]),
+        copy_legacy_admin_flag,
+        # keyset-пагинация пользователей сортирует по created_at и не видит строк с NULL
+        'UPDATE users SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL',
+        add_missing_columns('books', [
+            ('reserved_copies', 'INTEGER DEFAULT 0'),
+        ]),
+    ]),
+    (2, 'Индексы выдач под фильтры админ-панели и карточек читателя/книги', [
+        # admin_loans: WHERE status = ? ORDER BY loan_date DESC
+        'CREATE INDEX IF NOT EXISTS ix_loans_status_loan_date ON loans (status, loan_date)',
+        # admin_loans (все статусы), последние выдачи на главной админ-панели
+        'CREATE INDEX IF NOT EXISTS ix_loans_loan_date ON loans (loan_date)',
+        # admin_user_detail: WHERE reader_id = ? AND status = ? ORDER BY due_date
+        'CREATE INDEX IF NOT EXISTS ix_loans_reader_status_due_date ON loans (reader_id, status, due_date)',
+        # admin_book_detail, admin_delete_book: WHERE book_id = ? AND status = ?
+        'CREATE INDEX IF NOT EXISTS ix_loans_book_status ON loans (book_id, status)',
+        # история выдач книги: WHERE book_id = ? ORDER BY loan_date DESC
+        'CREATE INDEX IF NOT EXISTS ix_loans_book_loan_date ON loans (book_id, loan_date)',
+        # mark_overdue_loans: WHERE status = 'active' AND due_date < ?
+        'CREATE INDEX IF NOT EXISTS ix_loans_status_due_date ON loans (status, due_date)',
+    ]),
+    (3, 'Индексы резерваций', [
+        # admin_reservations, expire_reservations: WHERE status = ? ORDER BY / AND reservation_date
+        'CREATE INDEX IF NOT EXISTS ix_reservation_status_reservation_date '
+        'ON reservation (status, reservation_date)',
+        # admin_reservations (все статусы), последние резервации на главной админ-панели
+        'CREATE INDEX IF NOT EXISTS ix_reservation_reservation_date ON reservation (reservation_date)',
+        # admin_book_detail, admin_loan_detail: WHERE book_id = ? AND status = 'pending'
+        'CREATE INDEX IF NOT EXISTS ix_reservation_book_status ON reservation (book_id, status)',
+    ]),
+    (4, 'Индексы ключей сортировки пользователей и книг, статистика планировщика', [
+        # admin_users: ORDER BY created_at DESC
+        'CREATE INDEX IF NOT EXISTS ix_users_created_at ON users (created_at)',
+        # admin_books и каталог: ORDER BY title
+        'CREATE INDEX IF NOT EXISTS ix_books_title ON books (title)',
+        'ANALYZE',
+    ]),
+    (5, 'Версия каталога: счетчик изменений книг для ETag в API каталога', [
+        'CREATE TABLE IF NOT EXISTS catalog_version ('
+        'id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)',
+        'INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 1)',
+        'CREATE TRIGGER IF NOT EXISTS catalog_version_ai AFTER INSERT ON books BEGIN '
+        'UPDATE catalog_version SET version = version + 1 WHERE id = 1; END',
+        'CREATE TRIGGER IF NOT EXISTS catalog_version_ad AFTER DELETE ON books BEGIN '
+        'UPDATE catalog_version SET version = version + 1 WHERE id = 1; END',
+        # Колонки, которые видны в API каталога: правка книги и изменение доступности
+        # при резервации, выдаче, возврате и выполнении резервации
+        'CREATE TRIGGER IF NOT EXISTS catalog_version_au AFTER UPDATE OF '
+        'title, author, genre, publisher, publication_year, total_copies, available_copies ON books BEGIN '
+        'UPDATE catalog_version SET version = version + 1 WHERE id = 1; END',
+    ]),
+    (6, 'Очередь резерваций: повторные резервации книги и индекс очереди', [
+        drop_reservation_unique_constraint,
+        # Индексы миграции 3 удаляются вместе со старой таблицей
+        'CREATE INDEX IF NOT EXISTS ix_reservation_status_reservation_date '
+        'ON reservation (status, reservation_date)',
+        'CREATE INDEX IF NOT EXISTS ix_reservation_reservation_date ON reservation (reservation_date)',
+        # Очередь книги: в индексе (book_id, status) строки одного статуса упорядочены по
+        # rowid = id, поэтому голова очереди и место в ней находятся по этому же индексу
+        'CREATE INDEX IF NOT EXISTS ix_reservation_book_status ON reservation (book_id, status)',
+        # Не больше одной открытой резервации читателя на книгу
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_reservation_open ON reservation (reader_id, book_id) "
+        "WHERE status IN ('pending', 'waiting')",
+    ]),
+    (7, 'Поиск пользователей по префиксу фамилии, имени и почты без учета регистра', [
+        add_missing_columns('users', [
+            ('search_name', 'VARCHAR'),
+            ('search_given_name', 'VARCHAR'),
+            ('search_email', 'VARCHAR'),
+        ]),
+        fill_user_search_columns,
+        # admin_users: search_name >= ? AND search_name < ? и т.д. - диапазон по индексу
+        'CREATE INDEX IF NOT EXISTS ix_users_search_name ON users (search_name)',
+        'CREATE INDEX IF NOT EXISTS ix_users_search_given_name ON users (search_given_name)',
+        'CREATE INDEX IF NOT EXISTS ix_users_search_email ON users (search_email)',
+        'ANALYZE users',
+    ]),
+    (8, 'Счетчики фасетов каталога (жанр, автор, издательство, десятилетие) на триггерах', [
+        *FACETS_DDL,
+        rebuild_facets,
+    ]),
+]
+
+
+def _ensure_migrations_table(conn):
+    conn.execute(sa.text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, description VARCHAR, applied_at DATETIME)'
+    ))
+
+
+def current_version(engine):
+    """Номер последней примененной миграции (0 для новой базы)"""
+    with engine.begin() as conn:
+        _ensure_migrations_table(conn)
+        return conn.execute(sa.text('SELECT MAX(version) FROM schema_migrations')).scalar() or 0
+
+
+def migrate(engine):
+    """Применяет все еще не примененные миграции по порядку; возвращает список их номеров"""
+    version = current_version(engine)
+    applied = []
+
+    for migration_version, description, steps in MIGRATIONS:
+        if migration_version <= version:
+            continue
+
+        with engine.begin() as conn:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(sa.text(step))
+            conn.execute(
+                sa.text('INSERT INTO schema_migrations (version, description, applied_at) '
+                        'VALUES (:version, :description, :applied_at)'),
+                {'version': migration_version, 'description': description, 'applied_at': datetime.now()}
+            )
+
+        print(f'Применена миграция {migration_version}: {description}')
+        applied.append(migration_version)
+
+    return applied
@@ -10,9 +10,10 @@ from .users import User
 
 class Reservation(SqlAlchemyBase, SerializerMixin):
     __tablename__ = 'reservation'
-    __table_args__ = (
-        sa.UniqueConstraint('reader_id', 'book_id', name='unique_user_book_reservation'),
-    )
+    # Статусы: waiting - в очереди (свободных копий нет), pending - копия отложена и ждет
+    # выдачи, fulfilled, cancelled, expired. Очередь книги упорядочена по id. Одну открытую
+    # (waiting или pending) резервацию читателя на книгу обеспечивает частичный уникальный
+    # индекс ux_reservation_open из миграций
 
     id = sa.Column(sa.Integer,
                    primary_key=True, autoincrement=True)
@@ -0,0 +1,90 @@
+import re
+
+import sqlalchemy as sa
+
+
+# Полнотекстовый индекс по книгам (SQLite FTS5). Токенизатор unicode61 приводит к
+# нижнему регистру любые символы Unicode (в том числе кириллицу), поэтому "ТОЛСТОЙ"
+# находит "Толстой", а для латиницы дополнительно убирает диакритику ("Celine" -> "Céline").
+FTS_TABLE = 'books_fts'
+FTS_COLUMNS = ('title', 'author', 'publisher', 'genre')
+# Веса колонок для bm25: совпадение в названии важнее, чем в издательстве или жанре
+FTS_WEIGHTS = (10.0, 5.0, 1.0, 1.0)
+
+_columns = ', '.join(FTS_COLUMNS)
+_new_values = ', '.join(f'new.{column}' for column in FTS_COLUMNS)
+_old_values = ', '.join(f'old.{column}' for column in FTS_COLUMNS)
+
+FTS_DDL = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        {_columns},
+        content='books', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON books BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON books BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {_columns} ON books BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+        INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+)
+
+
+def init_search_index(engine):
+    """Создает FTS-индекс и триггеры синхронизации; для существующей базы заполняет индекс"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    with engine.begin() as conn:
+        exists = conn.execute(
+            sa.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': FTS_TABLE}
+        ).first()
+        for statement in FTS_DDL:
+            conn.execute(sa.text(statement))
+        if not exists:
+            conn.execute(sa.text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def rebuild_search_index(engine):
+    """Полностью перестраивает FTS-индекс по таблице books"""
+    init_search_index(engine)
+    with engine.begin() as conn:
+        conn.execute(sa.text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def to_match_expression(search_query):
+    """Преобразует пользовательский запрос в выражение MATCH: каждое слово ищется по префиксу"""
+    words = re.findall(r'\w+', search_query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def matching_book_ids(search_query):
+    """Подзапрос с id книг, найденных по FTS-индексу (для фильтрации Book.id.in_(...))"""
+    return sa.select(sa.literal_column('rowid')).select_from(sa.text(FTS_TABLE)).where(
+        sa.text(f'{FTS_TABLE} MATCH :fts_query').bindparams(fts_query=to_match_expression(search_query))
+    )
+
+
+def search_books(session, search_query, limit=20, offset=0):
+    """Строки книг (колонки books, без объектов ORM), найденные по запросу, в порядке релевантности (bm25)"""
+    match_expression = to_match_expression(search_query)
+    if not match_expression:
+        return []
+
+    weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+    statement = sa.text(
+        f"""SELECT books.id, books.title, books.author, books.publication_year, books.publisher,
+                   books.genre, books.available_copies
+            FROM {FTS_TABLE}
+            JOIN books ON books.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH :fts_query
+            ORDER BY bm25({FTS_TABLE}, {weights}), books.id
+            LIMIT :limit OFFSET :offset"""
+    ).bindparams(fts_query=match_expression, limit=limit, offset=offset)
+
+    return session.execute(statement)
@@ -5,6 +5,22 @@ from sqlalchemy_serializer import SerializerMixin
 from .db_session import SqlAlchemyBase
 
 
+def fold_search_text(text):
+    """Текст для поиска без учета регистра: casefold (lower() в SQLite не понимает кириллицу),
+    ё -> е и одиночные пробелы"""
+    if text is None:
+        return None
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def search_name_columns(full_name):
+    """(search_name, search_given_name): полное имя и имя без первого слова (фамилии)"""
+    name = fold_search_text(full_name)
+    if name is None:
+        return None, None
+    return name, name.partition(' ')[2]
+
+
 class User(SqlAlchemyBase, UserMixin, SerializerMixin):
     __tablename__ = 'users'
 
@@ -18,10 +34,24 @@ class User(SqlAlchemyBase, UserMixin, SerializerMixin):
     is_admin = sa.Column(sa.Integer, default=0)
     is_active = sa.Column(sa.Integer, default=1)
     created_at = sa.Column(sa.DateTime)
+    # Нормализованные копии имени и почты для поиска по индексу (см. fold_search_text):
+    # полное имя (начинается с фамилии), имя без фамилии и почта
+    search_name = sa.Column(sa.String)
+    search_given_name = sa.Column(sa.String)
+    search_email = sa.Column(sa.String)
 
     loans = orm.relationship('Loan', backref='reader', cascade="all, delete-orphan")
     reservations = orm.relationship('Reservation', backref='reader', cascade="all, delete-orphan")
 
+    @orm.validates('full_name', 'email')
+    def update_search_columns(self, key, value):
+        """Поддерживает колонки поиска при регистрации и изменении профиля"""
+        if key == 'full_name':
+            self.search_name, self.search_given_name = search_name_columns(value)
+        else:
+            self.search_email = fold_search_text(value)
+        return value
+
     @property
     def active_loans(self):
         """Активные выдачи книг"""
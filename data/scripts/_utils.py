@@ -1,10 +1,14 @@
+import base64
 import hashlib
+import json
 import random
-from datetime import datetime
+import zlib
+from datetime import date, datetime
 from string import ascii_letters, digits, ascii_uppercase, ascii_lowercase
 from random import choice, randint, shuffle
 
 import bcrypt
+import sqlalchemy as sa
 from flask_wtf import FlaskForm
 from wtforms import EmailField, PasswordField, BooleanField, SubmitField, StringField, DateField
 from wtforms.validators import DataRequired
@@ -13,6 +17,10 @@ from data.db_models.books import Book
 from data.db_models.db_session import create_session
 from data.db_models.users import User
 
+# Верхняя граница диапазона префикса: строки, начинающиеся с prefix, лежат в
+# [prefix, prefix + PREFIX_END) и при сравнении строк Python, и при двоичном сравнении SQLite
+PREFIX_END = '\U0010ffff'
+
 
 class LoginForm(FlaskForm):
     email = EmailField('Email', validators=[DataRequired()])
@@ -66,16 +74,218 @@ def paginate(query, page, per_page=20):
     return {
         'iter_pages': range(1, total_pages + 1),
         'total': len(items),
+        'total_items': total_items,
         'items': items,
         'page': page,
         'total_pages': total_pages,
         'has_prev': page > 1,
         'has_next': page < total_pages,
         'prev_num': page - 1 if page > 1 else None,
-        'next_num': page + 1 if page < total_pages else None
+        'next_num': page + 1 if page < total_pages else None,
+        'prev_cursor': None,
+        'next_cursor': None
     }
 
 
+def _dump_cursor_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+
+def _load_cursor_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        return date.fromisoformat(value['d'])
+    return value
+
+
+def encode_cursor(direction, values):
+    """Непрозрачный курсор: направление и значения ключей сортировки граничной строки"""
+    payload = json.dumps([direction, [_dump_cursor_value(value) for value in values]])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _cursor_value_fits(column, value):
+    """Значение курсора подходит к типу column: иначе запрос упал бы при выполнении"""
+    if value is None:
+        return True
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return True
+    if python_type is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    if python_type is float:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, python_type)
+
+
+def decode_cursor(cursor, columns=()):
+    """Разбирает курсор; для поврежденного курсора или курсора, значения которого не
+    подходят к типам columns (ключам сортировки), возвращает первую страницу"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(payload)
+        if direction not in ('next', 'prev') or len(values) != 2:
+            raise ValueError(cursor)
+        values = [_load_cursor_value(value) for value in values]
+        if not all(_cursor_value_fits(column, value) for column, value in zip(columns, values)):
+            raise ValueError(cursor)
+        return direction, values
+    except (ValueError, TypeError, KeyError):
+        return 'next', None
+
+
+def _seek_segments(order_column, id_column, values, descending):
+    """Условия продолжения после строки с ключом values в порядке сортировки.
+
+    SQLite ставит NULL раньше любых значений, поэтому при убывании строки с NULL в
+    order_column идут последними, а при возрастании - первыми. Сравнение кортежей с NULL
+    ложно, поэтому такие строки выбираются отдельным условием по id; каждое условие
+    использует индекс по order_column, а следующее нужно, только если строк не хватило.
+    """
+    if values is None:
+        return [sa.true()]
+    value, row_id = values
+    after_id = id_column < row_id if descending else id_column > row_id
+    if value is None:
+        nulls = sa.and_(order_column.is_(None), after_id)
+        return [nulls] if descending else [nulls, order_column.isnot(None)]
+
+    key = sa.tuple_(order_column, id_column)
+    bound = sa.tuple_(sa.literal(value, order_column.type), sa.literal(row_id, id_column.type))
+    if descending:
+        return [key < bound, order_column.is_(None)]
+    return [key > bound]
+
+
+def keyset_paginate(query, order_column, id_column, cursor=None, page=1, per_page=20,
+                    descending=True, with_total=False):
+    """Пагинация по ключу (seek): WHERE (order_column, id) < (...) LIMIT per_page + 1.
+
+    Не использует OFFSET, поэтому глубокие страницы не замедляются. Строки с NULL в
+    order_column не теряются: они идут в конце (при убывании) или в начале списка.
+    Общее количество считается только при with_total=True. Возвращает словарь того же
+    вида, что и paginate, с курсорами prev_cursor/next_cursor для ссылок "назад"/"вперед".
+    """
+    direction, values = decode_cursor(cursor, (order_column, id_column)) if cursor else ('next', None)
+    if values is None:
+        page = 1
+    backwards = direction == 'prev'
+    # Для ссылки "назад" идем от первой строки страницы в обратном порядке сортировки
+    seek_descending = descending != backwards
+
+    total_items = query.count() if with_total else None
+
+    if seek_descending:
+        query = query.order_by(order_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(order_column, id_column)
+
+    rows = []
+    for condition in _seek_segments(order_column, id_column, values, seek_descending):
+        rows += query.filter(condition).limit(per_page + 1 - len(rows)).all()
+        if len(rows) > per_page:
+            break
+
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    if backwards:
+        items.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = values is not None, has_more
+
+    def row_key(item):
+        return getattr(item, order_column.key), getattr(item, id_column.key)
+
+    if total_items is not None:
+        total_pages = (total_items + per_page - 1) // per_page
+    else:
+        total_pages = page + 1 if has_next else page
+
+    return {
+        'iter_pages': [page],
+        'total': len(items),
+        'total_items': total_items,
+        'items': items,
+        'page': page,
+        'total_pages': total_pages,
+        'has_prev': has_prev and bool(items),
+        'has_next': has_next and bool(items),
+        'prev_num': page - 1 if has_prev else None,
+        'next_num': page + 1 if has_next else None,
+        'prev_cursor': encode_cursor('prev', row_key(items[0])) if has_prev and items else None,
+        'next_cursor': encode_cursor('next', row_key(items[-1])) if has_next and items else None
+    }
+
+
+CATALOG_FILTERS = ('all', 'available', 'popular', 'new')
+
+# Колонки, которые отдает API каталога: выбираются кортежами, без загрузки объектов Book
+CATALOG_COLUMNS = (
+    Book.id, Book.title, Book.author, Book.publication_year, Book.publisher, Book.genre,
+    Book.total_copies, Book.available_copies,
+)
+
+CATALOG_SORT_KEYS = {
+    'title': Book.title,
+    'author': Book.author,
+    'year': Book.publication_year,
+    'available': Book.available_copies,
+}
+
+
+def filter_catalog(query, catalog_filter):
+    """Фильтры каталога: доступные, популярные (мало свободных копий) и новинки"""
+    if catalog_filter == 'available':
+        query = query.filter(Book.available_copies > 0)
+    elif catalog_filter == 'popular':
+        query = query.filter(Book.available_copies < 3)
+    elif catalog_filter == 'new':
+        query = query.filter(Book.publication_year >= datetime.now().year - 2)
+    return query
+
+
+def sort_catalog(query, sort):
+    """Сортировка каталога по ключу вида 'title' или '-year' (по убыванию), id - для стабильного порядка"""
+    descending = sort.startswith('-')
+    column = CATALOG_SORT_KEYS.get(sort.lstrip('-'), Book.title)
+    if descending:
+        return query.order_by(column.desc(), Book.id.desc())
+    return query.order_by(column, Book.id)
+
+
+def iter_json_array(items):
+    """JSON-массив по частям: элементы сериализуются по одному, весь список не собирается в памяти"""
+    yield '['
+    for i, item in enumerate(items):
+        yield (',' if i else '') + json.dumps(item, ensure_ascii=False, default=str)
+    yield ']'
+
+
+def iter_json_object(fields, array_key, items):
+    """JSON-объект с полями fields и потоковым массивом items под ключом array_key"""
+    head = json.dumps(fields, ensure_ascii=False, default=str)
+    yield head[:-1] + (', ' if fields else '') + json.dumps(array_key) + ': '
+    yield from iter_json_array(items)
+    yield '}'
+
+
+def iter_gzip(chunks, level=6):
+    """Сжимает поток текстовых частей в gzip по мере их появления"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
 def create_users():
     """Создает администратора (выполнить один раз)"""
     session = create_session()
@@ -0,0 +1,299 @@
+from collections import Counter
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from data.db_models.books import Book
+from data.db_models.loans import Loan
+from data.db_models.reservations import Reservation
+from data.db_models.users import User
+
+# Переходы выдач и резерваций одним условным UPDATE: проверка и изменение счетчиков
+# выполняются в базе атомарно, поэтому параллельные запросы не теряют обновления и не
+# выдают больше копий, чем есть. Функции возвращают, удался ли переход; коммит - за
+# вызывающим кодом, чтобы переход и связанные вставки шли в одной транзакции.
+
+
+def _update_book(session, book_id, condition, **values):
+    result = session.execute(
+        sa.update(Book)
+        .where(Book.id == book_id, condition)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def _has_queue(book_id):
+    return sa.exists().where(Reservation.book_id == book_id, Reservation.status == 'waiting')
+
+
+def reserve_copy(session, book_id):
+    """Доступная копия -> зарезервированная; False, если свободных копий нет или на книгу
+    есть очередь: свободные копии сначала достаются стоящим в ней (serve_waiting_holds)"""
+    return _update_book(session, book_id, sa.and_(Book.available_copies > 0, ~_has_queue(book_id)),
+                        available_copies=Book.available_copies - 1,
+                        reserved_copies=Book.reserved_copies + 1)
+
+
+def checkout_copy(session, book_id):
+    """Доступная копия -> выданная; False, если свободных копий нет"""
+    return _update_book(session, book_id, Book.available_copies > 0,
+                        available_copies=Book.available_copies - 1)
+
+
+def checkout_reserved_copy(session, book_id):
+    """Зарезервированная копия -> выданная (выполнение резервации)"""
+    return _update_book(session, book_id, Book.reserved_copies > 0,
+                        reserved_copies=Book.reserved_copies - 1)
+
+
+def release_reserved_copy(session, book_id):
+    """Зарезервированная копия освобождается (отмена или истечение резервации) и уходит
+    следующему в очереди или становится доступной"""
+    if not _update_book(session, book_id, Book.reserved_copies > 0, reserved_copies=Book.reserved_copies - 1):
+        return False
+    release_copy(session, book_id)
+    return True
+
+
+def return_copy(session, book_id):
+    """Выданная копия -> доступная; копий не может стать больше общего числа"""
+    return _update_book(session, book_id, Book.available_copies + Book.reserved_copies < Book.total_copies,
+                        available_copies=Book.available_copies + 1)
+
+
+def promote_waiting_hold(session, book_id):
+    """Первая в очереди резервация книги -> ожидающая выдачи; ее id или None, если очередь пуста.
+
+    Голова очереди - первая строка индекса ix_reservation_book_status (book_id, status, rowid),
+    поиск за O(log n). Срок ожидания выдачи (RESERVATION_TTL_DAYS) отсчитывается
+    от продвижения, поэтому дата резервации обновляется.
+    """
+    head = (
+        sa.select(Reservation.id)
+        .where(Reservation.book_id == book_id, Reservation.status == 'waiting')
+        .order_by(Reservation.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return session.execute(
+        sa.update(Reservation)
+        .where(Reservation.id == head, Reservation.status == 'waiting')
+        .values(status='pending', reservation_date=datetime.now().date())
+        .returning(Reservation.id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+
+def release_copy(session, book_id):
+    """Освободившаяся копия (возврат выдачи) откладывается первому в очереди, а если
+    очереди нет - становится доступной; id продвинутой резервации или None"""
+    hold_id = promote_waiting_hold(session, book_id)
+    if hold_id is not None:
+        _update_book(session, book_id, sa.true(), reserved_copies=Book.reserved_copies + 1)
+    else:
+        return_copy(session, book_id)
+    return hold_id
+
+
+def _promote_queue_heads(session, book_ids, copies):
+    """Первые copies ожидающих резерваций каждой книги из book_ids -> ожидающие выдачи.
+
+    copies - выражение над колонками Book (число копий, которые достаются очереди книги).
+    Очередь - порядок id резерваций книги (ROW_NUMBER по книгам), все книги продвигаются
+    одним UPDATE. Возвращает Counter {book_id: продвинуто резерваций}; счетчики копий
+    книг меняет вызывающий код.
+    """
+    queue = (
+        sa.select(Reservation.id, Reservation.book_id,
+                  sa.func.row_number().over(partition_by=Reservation.book_id, order_by=Reservation.id)
+                  .label('place'))
+        .where(Reservation.book_id.in_(book_ids), Reservation.status == 'waiting')
+        .subquery()
+    )
+    heads = (
+        sa.select(queue.c.id)
+        .join(Book, Book.id == queue.c.book_id)
+        .where(queue.c.place <= copies)
+    )
+    return Counter(session.execute(
+        sa.update(Reservation)
+        .where(Reservation.id.in_(heads))
+        .values(status='pending', reservation_date=datetime.now().date())
+        .returning(Reservation.book_id)
+        .execution_options(synchronize_session=False)
+    ).scalars())
+
+
+def serve_waiting_holds(session, book_ids):
+    """Свободные копии книг откладываются первым в их очередях (после добавления копий).
+
+    Первые available_copies ожидающих резерваций каждой книги продвигаются одним UPDATE
+    (_promote_queue_heads), их копии переходят из доступных в зарезервированные вторым.
+    Возвращает Counter {book_id: продвинуто резерваций}. Работает и с сессией, и с
+    соединением (импорт каталога).
+    """
+    promoted = _promote_queue_heads(session, book_ids, Book.available_copies)
+    if promoted:
+        session.execute(
+            sa.update(Book)
+            .where(Book.id.in_(promoted))
+            .values(available_copies=Book.available_copies - _per_id(Book.id, promoted),
+                    reserved_copies=Book.reserved_copies + _per_id(Book.id, promoted))
+            .execution_options(synchronize_session=False)
+        )
+    return promoted
+
+
+def queue_position(session, book_id, reservation_id):
+    """Место резервации в очереди книги (1 - следующая); считается по индексу ix_reservation_book_status"""
+    return session.execute(
+        sa.select(sa.func.count(Reservation.id))
+        .where(Reservation.book_id == book_id, Reservation.status == 'waiting', Reservation.id <= reservation_id)
+    ).scalar()
+
+
+def queue_length(session, book_id):
+    """Число резерваций в очереди книги"""
+    return session.execute(
+        sa.select(sa.func.count(Reservation.id))
+        .where(Reservation.book_id == book_id, Reservation.status == 'waiting')
+    ).scalar()
+
+
+def close_loan(session, loan_id, return_date=None):
+    """Отмечает выдачу возвращенной, если она еще не возвращена; book_id выдачи или None"""
+    return session.execute(
+        sa.update(Loan)
+        .where(Loan.id == loan_id, Loan.status.in_(['active', 'overdue']))
+        .values(status='returned', return_date=return_date or datetime.now().date())
+        .returning(Loan.book_id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+
+def close_reservation(session, reservation_id, status, from_status='pending', **values):
+    """Переводит резервацию из from_status в status; (reader_id, book_id) или None, если она уже обработана"""
+    return session.execute(
+        sa.update(Reservation)
+        .where(Reservation.id == reservation_id, Reservation.status == from_status)
+        .values(status=status, **values)
+        .returning(Reservation.reader_id, Reservation.book_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+
+
+# Пакетные операции стойки выдачи: каждая выполняется несколькими set-based запросами
+# на весь пакет, а не запросами на каждую книгу. Возвращают результат по каждому элементу
+# в порядке входного списка; коммит - за вызывающим кодом.
+
+def _per_id(column, counts):
+    """CASE column WHEN id THEN count ... для UPDATE с разными значениями по строкам"""
+    if not counts:
+        return sa.literal(0)
+    return sa.case(counts, value=column, else_=0)
+
+
+def checkout_many(session, items, due_date):
+    """Выдает книги по списку (user_id, book_id).
+
+    Копии списываются одним условным UPDATE: книга выдается, только если свободных копий
+    хватает на все ее выдачи в пакете. Выдачи вставляются одним INSERT.
+    """
+    user_ids = {user_id for user_id, book_id in items}
+    active_users = set(session.execute(
+        sa.select(User.id).where(User.id.in_(user_ids), User.is_active == True)  # noqa: E712
+    ).scalars())
+
+    demand = Counter(book_id for user_id, book_id in items if user_id in active_users)
+    granted = set()
+    if demand:
+        granted = set(session.execute(
+            sa.update(Book)
+            .where(Book.id.in_(demand), Book.available_copies >= _per_id(Book.id, demand))
+            .values(available_copies=Book.available_copies - _per_id(Book.id, demand))
+            .returning(Book.id)
+            .execution_options(synchronize_session=False)
+        ).scalars())
+    existing_books = granted
+    if len(granted) < len(demand):
+        existing_books = set(session.execute(sa.select(Book.id).where(Book.id.in_(demand))).scalars())
+
+    results, rows = [], []
+    for user_id, book_id in items:
+        if user_id not in active_users:
+            results.append({'user_id': user_id, 'book_id': book_id, 'ok': False,
+                            'error': 'Пользователь не найден или заблокирован'})
+        elif book_id not in existing_books:
+            results.append({'user_id': user_id, 'book_id': book_id, 'ok': False, 'error': 'Книга не найдена'})
+        elif book_id not in granted:
+            results.append({'user_id': user_id, 'book_id': book_id, 'ok': False,
+                            'error': 'Недостаточно свободных копий'})
+        else:
+            results.append({'user_id': user_id, 'book_id': book_id, 'ok': True})
+            rows.append({'reader_id': user_id, 'book_id': book_id, 'loan_date': datetime.now().date(),
+                         'due_date': due_date, 'status': 'active'})
+
+    if rows:
+        loan_ids = session.execute(
+            sa.insert(Loan).returning(Loan.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        for result, loan_id in zip((result for result in results if result['ok']), loan_ids):
+            result['loan_id'] = loan_id
+    return results
+
+
+def return_many(session, loan_ids):
+    """Возвращает выдачи по списку id.
+
+    Выдачи закрываются одним UPDATE ... RETURNING; освободившиеся копии каждой книги
+    достаются первым в ее очереди (один UPDATE с ROW_NUMBER по книгам), остальные
+    становятся доступными (один UPDATE с CASE по книгам).
+    """
+    closed = dict(session.execute(
+        sa.update(Loan)
+        .where(Loan.id.in_(loan_ids), Loan.status.in_(['active', 'overdue']))
+        .values(status='returned', return_date=datetime.now().date())
+        .returning(Loan.id, Loan.book_id)
+        .execution_options(synchronize_session=False)
+    ).all())
+
+    freed = Counter(closed.values())
+    promoted = Counter()
+    if freed:
+        promoted = _promote_queue_heads(session, freed, _per_id(Book.id, freed))
+        session.execute(
+            sa.update(Book)
+            .where(Book.id.in_(freed))
+            .values(reserved_copies=Book.reserved_copies + _per_id(Book.id, promoted),
+                    available_copies=Book.available_copies + _per_id(Book.id, freed - promoted))
+            .execution_options(synchronize_session=False)
+        )
+
+    results = []
+    for loan_id in loan_ids:
+        # Повторный id в пакете - это уже возвращенная выдача
+        book_id = closed.pop(loan_id, None)
+        if book_id is None:
+            results.append({'loan_id': loan_id, 'ok': False, 'error': 'Выдача не найдена или уже возвращена'})
+        else:
+            results.append({'loan_id': loan_id, 'ok': True, 'book_id': book_id})
+    return results
+
+
+def extend_many(session, loan_ids, due_date):
+    """Продлевает срок возврата невозвращенных выдач одним UPDATE; просроченная выдача,
+    срок которой перенесен не раньше чем на сегодня, снова становится активной"""
+    status = 'active' if due_date >= datetime.now().date() else Loan.status
+    extended = set(session.execute(
+        sa.update(Loan)
+        .where(Loan.id.in_(loan_ids), Loan.status.in_(['active', 'overdue']))
+        .values(due_date=due_date, status=status)
+        .returning(Loan.id)
+        .execution_options(synchronize_session=False)
+    ).scalars())
+
+    return [{'loan_id': loan_id, 'ok': True} if loan_id in extended
+            else {'loan_id': loan_id, 'ok': False, 'error': 'Выдача не найдена или уже возвращена'}
+            for loan_id in loan_ids]
@@ -0,0 +1,161 @@
+import csv
+import io
+import json
+from datetime import date, datetime, time, timedelta
+
+import sqlalchemy as sa
+
+from data.db_models.books import Book
+from data.db_models.loans import Loan
+from data.db_models.reservations import Reservation
+from data.db_models.users import User
+
+# Выгрузки читают строки порциями (yield_per) и сразу отдают их в CSV/JSONL, поэтому
+# память не зависит от размера таблицы. Читать нужно сессией пула только для чтения:
+# ее соединения не берут блокировку записи, а в режиме WAL долгая загрузка не мешает
+# выдачам и возвратам.
+
+# Строк в одной порции курсора и в одной части ответа
+BATCH_SIZE = 1000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+# Фильтры по статусу для таблиц без колонки status
+USER_STATUSES = {
+    'active': User.is_active == 1,
+    'blocked': User.is_active == 0,
+    'admin': User.is_admin == 1,
+}
+BOOK_STATUSES = {
+    'available': Book.available_copies > 0,
+    'unavailable': Book.available_copies == 0,
+}
+
+# Выгрузка: колонки, колонка даты для фильтра и порядка, статусы
+EXPORTS = {
+    'loans': {
+        'columns': (Loan.id, Loan.reader_id, User.email.label('reader_email'), Loan.book_id,
+                    Book.title.label('book_title'), Loan.loan_date, Loan.due_date, Loan.return_date,
+                    Loan.status),
+        'joins': ((User, Loan.reader_id == User.id), (Book, Loan.book_id == Book.id)),
+        'date': Loan.loan_date,
+        'statuses': {status: Loan.status == status for status in ('active', 'overdue', 'returned')},
+    },
+    'reservations': {
+        'columns': (Reservation.id, Reservation.reader_id, User.email.label('reader_email'), Reservation.book_id,
+                    Book.title.label('book_title'), Reservation.reservation_date, Reservation.status),
+        'joins': ((User, Reservation.reader_id == User.id), (Book, Reservation.book_id == Book.id)),
+        'date': Reservation.reservation_date,
+        'statuses': {status: Reservation.status == status
+                     for status in ('waiting', 'pending', 'fulfilled', 'cancelled', 'expired')},
+    },
+    'users': {
+        'columns': (User.id, User.full_name, User.email, User.birthday, User.is_admin, User.is_active,
+                    User.created_at),
+        'joins': (),
+        'date': User.created_at,
+        'statuses': USER_STATUSES,
+    },
+    'books': {
+        'columns': (Book.id, Book.title, Book.author, Book.genre, Book.publisher, Book.publication_year,
+                    Book.total_copies, Book.available_copies, Book.reserved_copies, Book.location),
+        'joins': (),
+        'date': None,
+        'statuses': BOOK_STATUSES,
+    },
+}
+
+
+def parse_date(value, name):
+    """Дата фильтра в формате ГГГГ-ММ-ДД или None"""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Неверная дата {name}: {value}, нужен формат ГГГГ-ММ-ДД') from None
+
+
+def export_query(kind, status=None, date_from=None, date_to=None):
+    """SELECT выгрузки kind с фильтрами; ValueError при неизвестной выгрузке или статусе.
+
+    Порядок (дата, id) совпадает с индексами по дате (в т.ч. (status, дата)), поэтому
+    SQLite читает строки по индексу без сортировки во временной таблице.
+    """
+    if kind not in EXPORTS:
+        raise ValueError(f'Неизвестная выгрузка: {kind}')
+    spec = EXPORTS[kind]
+    id_column = spec['columns'][0]
+
+    query = sa.select(*spec['columns'])
+    for target, condition in spec['joins']:
+        query = query.outerjoin(target, condition)
+
+    if status and status != 'all':
+        if status not in spec['statuses']:
+            raise ValueError(f'Неизвестный статус: {status}')
+        query = query.where(spec['statuses'][status])
+
+    date_column = spec['date']
+    if date_column is None:
+        if date_from or date_to:
+            raise ValueError(f'Выгрузку {kind} нельзя фильтровать по дате')
+        return query.order_by(id_column)
+
+    if isinstance(date_column.type, sa.DateTime):
+        # Границы включительно: для колонок DateTime - до начала следующего дня
+        date_from = date_from and datetime.combine(date_from, time.min)
+        date_to = date_to and datetime.combine(date_to + timedelta(days=1), time.min)
+    else:
+        date_to = date_to and date_to + timedelta(days=1)
+    if date_from:
+        query = query.where(date_column >= date_from)
+    if date_to:
+        query = query.where(date_column < date_to)
+    return query.order_by(date_column, id_column)
+
+
+def iter_rows(session, query, batch_size=BATCH_SIZE):
+    """Строки запроса словарями; в памяти одновременно не больше batch_size строк"""
+    result = session.execute(query, execution_options={'yield_per': batch_size})
+    yield from result.mappings()
+
+
+def iter_csv(columns, rows, batch_size=BATCH_SIZE):
+    """CSV по частям: заголовок и по batch_size строк в каждой части"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row[column] for column in columns)
+        if i % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_jsonl(rows, batch_size=BATCH_SIZE):
+    """JSON Lines по частям: по объекту на строку, по batch_size строк в каждой части"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(row), ensure_ascii=False, default=str) + '\n')
+        if len(lines) == batch_size:
+            yield ''.join(lines)
+            lines.clear()
+    if lines:
+        yield ''.join(lines)
+
+
+def iter_export(session, kind, export_format='csv', status=None, date_from=None, date_to=None):
+    """Потоковая выгрузка kind в формате export_format; ValueError при неверных параметрах"""
+    if export_format not in FORMATS:
+        raise ValueError(f'Неизвестный формат: {export_format}')
+    query = export_query(kind, status, date_from, date_to)
+    rows = iter_rows(session, query)
+    if export_format == 'csv':
+        return iter_csv([column.key for column in query.selected_columns], rows)
+    return iter_jsonl(rows)
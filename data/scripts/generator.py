@@ -0,0 +1,238 @@
+import argparse
+import hashlib
+import itertools
+import os
+import random
+import time
+from datetime import date, datetime, timedelta
+
+import bcrypt
+
+from data.db_models import __all_models  # noqa: F401 - регистрирует все таблицы
+from data.db_models.db_session import SqlAlchemyBase, create_engine
+from data.db_models.migrations import migrate
+from data.db_models.search import init_search_index
+
+# Размеры набора данных при scale=1; --scale 0.01 дает 100 читателей, 10 000 книг и 50 000 выдач
+BASE_USERS = 10_000
+BASE_BOOKS = 1_000_000
+BASE_LOANS = 5_000_000
+BASE_RESERVATIONS = 100_000
+# Глубина истории выдач
+HISTORY_DAYS = 5 * 365
+BATCH_SIZE = 50_000
+
+FIRST_NAMES = [
+    "Александр", "Мария", "Дмитрий", "Анна", "Сергей", "Елена", "Андрей", "Ольга", "Алексей", "Наталья",
+    "Иван", "Татьяна", "Михаил", "Екатерина", "Николай", "Ирина", "Павел", "Светлана", "Юрий", "Дарья",
+]
+SURNAMES = [
+    "Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов", "Новиков",
+    "Федоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семенов", "Егоров", "Павлов", "Козлов",
+    "Степанов", "Николаев", "Орлов", "Андреев", "Макаров", "Никитин", "Захаров", "Зайцев", "Соловьев",
+]
+TITLE_WORDS = [
+    "Тайна", "Дорога", "Память", "Город", "Сад", "Тень", "Песня", "Зима", "Берег", "Ночь", "Свет", "Дом",
+    "Остров", "Море", "Ветер", "Письмо", "Сон", "Время", "Голос", "Мост", "Путь", "Звезда", "Лес", "Река",
+]
+TITLE_TAILS = [
+    "забытых королей", "над рекой", "без имени", "в тумане", "прошлого", "будущего", "на краю света",
+    "и свет", "навсегда", "в поезде", "ледяного замка", "старого дома", "северного ветра", "и дождь",
+    "последнего лета", "в библиотеке", "у моря", "огненной горы", "длинной ночи", "белых ночей",
+]
+# Жанры с весами: романов и детективов в фонде больше, чем поэзии
+GENRES = {
+    "Роман": 20, "Детектив": 12, "Фэнтези": 9, "Научная фантастика": 7, "Исторический роман": 6,
+    "Современная проза": 8, "Триллер": 6, "Классика": 6, "Приключения": 5, "Биография": 3,
+    "Поэзия": 2, "Драма": 3, "Публицистика": 3, "Философия": 2, "Психология": 3, "Ужасы": 2,
+    "Антиутопия": 2, "Мистика": 2,
+}
+PUBLISHERS = [
+    "Эксмо", "АСТ", "Азбука", "Амфора", "Манн, Иванов и Фербер", "Альпина Паблишер", "Corpus",
+    "Ad Marginem", "Новое литературное обозрение", "Текст", "Иностранка", "Симпозиум", "Росмэн",
+]
+
+
+def password_fields(password):
+    """Соль и хэш пароля в том же формате, что и при регистрации"""
+    salt = bcrypt.gensalt()
+    return hashlib.md5((password + salt.decode()).encode()).digest(), salt
+
+
+def generate_users(rng, count, today):
+    """Администратор и читатель с паролями из create_users, затем синтетические читатели"""
+    now = datetime.combine(today, datetime.min.time())
+    admin_pass, admin_salt = password_fields('admin123')
+    user_pass, user_salt = password_fields('user123')
+    yield ("Администратор Системы", "admin@library.ru", date(1990, 1, 1).isoformat(), admin_pass, admin_salt,
+           1, 1, (now - timedelta(days=HISTORY_DAYS + 1)).isoformat(' '))
+    yield ("Пользователь 1", "user@library.ru", date(1990, 1, 1).isoformat(), user_pass, user_salt,
+           0, 1, (now - timedelta(days=HISTORY_DAYS + 1)).isoformat(' '))
+
+    # Синтетическим читателям хватает одного хэша: вход под ними не нужен
+    reader_pass, reader_salt = password_fields('reader123')
+    for i in range(3, count + 1):
+        name = f'{rng.choice(SURNAMES)} {rng.choice(FIRST_NAMES)}'
+        birthday = date(1950, 1, 1) + timedelta(days=rng.randrange(0, 55 * 365))
+        created_at = now - timedelta(days=rng.randrange(0, HISTORY_DAYS), seconds=rng.randrange(0, 86400))
+        yield (name, f'reader{i}@library.ru', birthday.isoformat(), reader_pass, reader_salt,
+               0, int(rng.random() > 0.02), created_at.isoformat(' '))
+
+
+def generate_book_attributes(rng, count):
+    """Характеристики книг: число копий и популярность (распределение, близкое к Ципфу)"""
+    total_copies = [min(1 + int(rng.expovariate(0.5)), 20) for _ in range(count)]
+    # Популярность книги i пропорциональна 1 / i^0.8; номера книг перемешаны,
+    # чтобы популярные книги не шли подряд
+    order = list(range(count))
+    rng.shuffle(order)
+    weights = [0.0] * count
+    for rank, book_index in enumerate(order, start=1):
+        weights[book_index] = 1.0 / rank ** 0.8
+    return total_copies, list(itertools.accumulate(weights))
+
+
+def generate_loans(rng, count, users, total_copies, cum_weights, today, outstanding):
+    """Выдачи в хронологическом порядке; outstanding - копии на руках по книгам (заполняется)"""
+    books = len(total_copies)
+    start = today - timedelta(days=HISTORY_DAYS)
+    dates = [(start + timedelta(days=day)) for day in range(HISTORY_DAYS + 60)]
+
+    produced = 0
+    while produced < count:
+        batch = min(BATCH_SIZE, count - produced)
+        book_indexes = rng.choices(range(books), cum_weights=cum_weights, k=batch)
+        for offset, book_index in enumerate(book_indexes):
+            day = (produced + offset) * HISTORY_DAYS // count
+            loan_date = dates[day]
+            age = HISTORY_DAYS - day
+            due_date = dates[day + rng.choice((14, 14, 14, 21, 30))]
+
+            # Недавние выдачи чаще еще на руках, старые почти все возвращены
+            returned_probability = min(age / 40, 0.97) if age < 60 else 0.97
+            book_id = book_index + 1
+            if rng.random() < returned_probability or outstanding[book_index] >= total_copies[book_index]:
+                return_day = min(day + rng.randint(1, 35), HISTORY_DAYS)
+                yield (rng.randint(2, users), book_id, loan_date.isoformat(), due_date.isoformat(),
+                       dates[return_day].isoformat(), 'returned')
+            else:
+                outstanding[book_index] += 1
+                status = 'overdue' if due_date < today else 'active'
+                yield (rng.randint(2, users), book_id, loan_date.isoformat(), due_date.isoformat(), None, status)
+        produced += batch
+
+
+def generate_reservations(rng, count, users, total_copies, cum_weights, today, outstanding, reserved):
+    """Резервации за последний год; ожидающие резервации занимают свободные копии (reserved)"""
+    books = len(total_copies)
+    seen = set()
+    book_indexes = rng.choices(range(books), cum_weights=cum_weights, k=count)
+    for i, book_index in enumerate(book_indexes):
+        reader_id = rng.randint(2, users)
+        if (reader_id, book_index) in seen:
+            continue
+        seen.add((reader_id, book_index))
+
+        age = 365 - i * 365 // count
+        reservation_date = today - timedelta(days=age)
+        free = total_copies[book_index] - outstanding[book_index] - reserved[book_index]
+        if age <= 3 and free > 0 and rng.random() < 0.6:
+            reserved[book_index] += 1
+            status = 'pending'
+        else:
+            status = rng.choices(('fulfilled', 'cancelled', 'expired'), weights=(70, 15, 15))[0]
+        yield reader_id, book_index + 1, reservation_date.isoformat(), status
+
+
+def generate_books(rng, total_copies, outstanding, reserved):
+    authors = [f'{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}' for _ in range(max(100, len(total_copies) // 20))]
+    genres, genre_weights = list(GENRES), list(GENRES.values())
+    for i, total in enumerate(total_copies):
+        title = f'{rng.choice(TITLE_WORDS)} {rng.choice(TITLE_TAILS)}'
+        if rng.random() < 0.5:
+            title += f' ({rng.randint(1, 99)})'
+        # Год издания: больше новых книг, но есть и классика
+        year = int(rng.triangular(1800, 2025, 2018))
+        location = f'{chr(ord("A") + rng.randrange(10))}{rng.randint(1, 50)}'
+        yield (rng.choice(authors), rng.choices(genres, genre_weights)[0], rng.choice(PUBLISHERS), title, year,
+               total, total - outstanding[i] - reserved[i], reserved[i], location)
+
+
+def generate_dataset(db_file, scale=0.01, seed=42, progress=print):
+    """Создает файл SQLite с синтетическими читателями, книгами, выдачами и резервациями.
+
+    Данные пишутся напрямую через executemany без индексов и триггеров; индексы,
+    триггеры и полнотекстовый индекс создаются миграциями после загрузки.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    users = max(2, int(BASE_USERS * scale))
+    books = max(1, int(BASE_BOOKS * scale))
+    loans = int(BASE_LOANS * scale)
+    reservations = int(BASE_RESERVATIONS * scale)
+
+    engine = create_engine(db_file, 'default')
+    SqlAlchemyBase.metadata.create_all(engine)
+    start = time.perf_counter()
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA journal_mode = OFF')
+        cursor.execute('PRAGMA synchronous = OFF')
+
+        cursor.executemany(
+            'INSERT INTO users (full_name, email, birthday, hashed_password, salt, is_admin, is_active, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', generate_users(rng, users, today))
+        progress(f'Читатели: {users} ({time.perf_counter() - start:.1f} с)')
+
+        total_copies, cum_weights = generate_book_attributes(rng, books)
+        outstanding = [0] * books
+        reserved = [0] * books
+
+        cursor.executemany(
+            'INSERT INTO loans (reader_id, book_id, loan_date, due_date, return_date, status) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            generate_loans(rng, loans, users, total_copies, cum_weights, today, outstanding))
+        progress(f'Выдачи: {loans} ({time.perf_counter() - start:.1f} с)')
+
+        cursor.executemany(
+            'INSERT INTO reservation (reader_id, book_id, reservation_date, status) VALUES (?, ?, ?, ?)',
+            generate_reservations(rng, reservations, users, total_copies, cum_weights, today, outstanding, reserved))
+        progress(f'Резервации: до {reservations} ({time.perf_counter() - start:.1f} с)')
+
+        cursor.executemany(
+            'INSERT INTO books (author, genre, publisher, title, publication_year, total_copies, '
+            'available_copies, reserved_copies, location) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            generate_books(rng, total_copies, outstanding, reserved))
+        progress(f'Книги: {books} ({time.perf_counter() - start:.1f} с)')
+
+        connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+
+    migrate(engine)
+    init_search_index(engine)
+    engine.dispose()
+    progress(f'Индексы построены, всего {time.perf_counter() - start:.1f} с')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Синтетический набор данных для проверки производительности (python -m data.scripts.generator)')
+    parser.add_argument('path', help='файл базы данных, который будет создан')
+    parser.add_argument('--scale', type=float, default=0.01,
+                        help=f'масштаб: 1 = {BASE_USERS} читателей, {BASE_BOOKS} книг, {BASE_LOANS} выдач')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help='перезаписать существующий файл')
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        if not args.force:
+            parser.error(f'{args.path} уже существует (используйте --force)')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+
+    generate_dataset(args.path, args.scale, args.seed)
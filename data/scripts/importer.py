@@ -0,0 +1,220 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+import sqlalchemy as sa
+
+from data.db_models.books import Book
+from data.db_models.db_session import get_engine, global_init
+from data.scripts.circulation import serve_waiting_holds
+
+CHUNK_SIZE = 1000
+
+# Синонимы колонок входного файла -> колонки таблицы books
+FIELD_ALIASES = {
+    'year': 'publication_year',
+    'copies': 'total_copies',
+}
+INT_FIELDS = ('publication_year', 'total_copies', 'available_copies')
+
+books = Book.__table__
+
+INSERT_BOOK = books.insert().values(
+    title=sa.bindparam('title'),
+    author=sa.bindparam('author'),
+    genre=sa.bindparam('genre'),
+    publisher=sa.bindparam('publisher'),
+    publication_year=sa.bindparam('publication_year'),
+    total_copies=sa.bindparam('total_copies'),
+    available_copies=sa.bindparam('available_copies'),
+    reserved_copies=0,
+    location=sa.bindparam('location'),
+)
+# При повторном импорте доступные копии меняются на разницу в общем числе копий,
+# чтобы не потерять книги, которые сейчас на руках. Строки, где копий становится меньше,
+# чем выдано и зарезервировано, отклоняет import_chunk; max(0, ...) - на случай выдачи
+# между проверкой и обновлением
+UPDATE_BOOK = books.update().where(books.c.id == sa.bindparam('book_id')).values(
+    genre=sa.bindparam('genre'),
+    publisher=sa.bindparam('publisher'),
+    total_copies=sa.bindparam('total_copies'),
+    available_copies=sa.func.max(0, books.c.available_copies + sa.bindparam('total_copies') - books.c.total_copies),
+    location=sa.func.coalesce(sa.bindparam('location'), books.c.location),
+)
+
+
+def read_rows(path, file_format=None):
+    """Построчно читает CSV или JSONL (формат по расширению файла), не загружая файл целиком.
+
+    Возвращает пары (номер строки файла, строка); строка JSONL, которая не разбирается как
+    JSON, возвращается как ValueError, чтобы ее можно было пропустить, не прерывая импорт.
+    """
+    file_format = file_format or os.path.splitext(path)[1].lstrip('.').lower()
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        elif file_format in ('jsonl', 'ndjson'):
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    yield line_number, ValueError(f'некорректный JSON: {e}')
+        else:
+            raise ValueError(f'Неизвестный формат файла: {file_format}')
+
+
+def normalize(row):
+    """Приводит строку файла к колонкам books; ValueError с причиной, если строка непригодна для импорта"""
+    if isinstance(row, ValueError):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError('строка не является объектом')
+    book = {FIELD_ALIASES.get(key.strip(), key.strip()): value for key, value in row.items() if key}
+    for field in INT_FIELDS:
+        value = book.get(field)
+        if value in (None, ''):
+            book[field] = None
+            continue
+        try:
+            book[field] = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{field}: не целое число {value!r}') from None
+
+    if not book.get('title') or not book.get('author'):
+        raise ValueError('нет названия или автора')
+
+    book['total_copies'] = book['total_copies'] or 1
+    if book['available_copies'] is None:
+        book['available_copies'] = book['total_copies']
+    if book['total_copies'] < 0 or book['available_copies'] < 0:
+        raise ValueError('отрицательное число копий')
+    if book['available_copies'] > book['total_copies']:
+        raise ValueError('доступных копий больше, чем всего')
+    for field in ('genre', 'publisher', 'location'):
+        book[field] = book.get(field) or None
+    return book
+
+
+def natural_key(book):
+    """Естественный ключ книги: название, автор и год издания"""
+    return book['title'], book['author'], book['publication_year']
+
+
+def import_chunk(conn, chunk):
+    """Вставляет новые и обновляет существующие книги пачки {ключ: (номер строки, книга)}.
+
+    Возвращает (вставлено, обновлено, отклонено), где отклонено - список (номер строки,
+    причина) обновлений, оставляющих копий меньше, чем сейчас выдано и зарезервировано.
+    """
+    existing = {}
+    titles = list({title for title, author, year in chunk})
+    for book_id, title, author, year, total, available in conn.execute(
+            sa.select(books.c.id, books.c.title, books.c.author, books.c.publication_year,
+                      books.c.total_copies, books.c.available_copies)
+            .where(books.c.title.in_(titles)).order_by(books.c.id)):
+        existing.setdefault((title, author, year), (book_id, total, available))
+
+    inserts, updates, rejected, added_copies = [], [], [], []
+    for key, (line_number, book) in chunk.items():
+        if key not in existing:
+            inserts.append(book)
+            continue
+        book_id, total, available = existing[key]
+        in_use = total - available
+        if book['total_copies'] < in_use:
+            rejected.append((line_number, f"копий {book['total_copies']}, а выдано и зарезервировано {in_use}"))
+        else:
+            updates.append({**book, 'book_id': book_id})
+            if book['total_copies'] > total:
+                added_copies.append(book_id)
+
+    if inserts:
+        conn.execute(INSERT_BOOK, inserts)
+    if updates:
+        conn.execute(UPDATE_BOOK, updates)
+    if added_copies:
+        # Новые копии сначала достаются стоящим в очереди на книгу
+        serve_waiting_holds(conn, added_copies)
+    return len(inserts), len(updates), rejected
+
+
+def print_progress(stats):
+    print(f"Обработано {stats['rows']} строк: добавлено {stats['inserted']}, обновлено {stats['updated']}, "
+          f"пропущено {stats['skipped']} ({stats['rows_per_sec']:.0f} строк/с)")
+
+
+def print_skipped(line_number, reason):
+    print(f'Строка {line_number} пропущена: {reason}', file=sys.stderr)
+
+
+def import_books(path, file_format=None, chunk_size=CHUNK_SIZE, progress=print_progress, skipped=print_skipped):
+    """Потоковый импорт книг из CSV/JSONL пачками по chunk_size строк, каждая в своей транзакции.
+
+    Книга с тем же названием, автором и годом обновляется, иначе добавляется; из
+    повторов книги в одной пачке применяется последний, а остальные пропускаются.
+    Непригодные строки не прерывают импорт: они считаются в stats['skipped'] и
+    передаются в skipped(номер строки, причина), так что rows = inserted + updated + skipped. Память ограничена размером пачки
+    независимо от размера файла.
+    """
+    engine = get_engine()
+    stats = {'rows': 0, 'inserted': 0, 'updated': 0, 'skipped': 0, 'seconds': 0.0, 'rows_per_sec': 0.0}
+    start = time.perf_counter()
+    rows = read_rows(path, file_format)
+
+    while True:
+        batch = list(islice(rows, chunk_size))
+        if not batch:
+            break
+
+        chunk, rejected = {}, []
+        for line_number, row in batch:
+            try:
+                book = normalize(row)
+            except ValueError as e:
+                rejected.append((line_number, str(e)))
+            else:
+                key = natural_key(book)
+                if key in chunk:
+                    # Из повторов книги в одной пачке применяется последний
+                    rejected.append((chunk[key][0], f'заменена строкой {line_number} с той же книгой'))
+                chunk[key] = line_number, book
+
+        with engine.begin() as conn:
+            inserted, updated, rejected_updates = import_chunk(conn, chunk)
+
+        rejected += rejected_updates
+        stats['skipped'] += len(rejected)
+        if skipped:
+            for line_number, reason in sorted(rejected):
+                skipped(line_number, reason)
+
+        stats['rows'] += len(batch)
+        stats['inserted'] += inserted
+        stats['updated'] += updated
+        stats['seconds'] = time.perf_counter() - start
+        stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+        if progress:
+            progress(stats)
+
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Импорт каталога из CSV/JSONL (python -m data.scripts.importer)')
+    parser.add_argument('path', help='файл CSV или JSONL')
+    parser.add_argument('--db', default='db/database.db', help='файл базы данных')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help='формат файла (по умолчанию - по расширению)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='строк в одной транзакции')
+    args = parser.parse_args()
+
+    global_init(args.db)
+    result = import_books(args.path, args.format, args.chunk_size)
+    print(f"Готово за {result['seconds']:.1f} с")
@@ -0,0 +1,190 @@
+import bisect
+import os
+import threading
+import time
+
+import sqlalchemy as sa
+from flask import current_app, g, request
+
+# Верхние границы корзин гистограммы задержек, секунды (как в клиентах Prometheus)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# SQL-запросы текущего потока: (число, время) считаются только внутри запроса
+_current = threading.local()
+
+
+class EndpointStats:
+    __slots__ = ('requests', 'errors', 'seconds', 'max_seconds', 'buckets', 'sql_statements', 'sql_seconds')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        # Последняя корзина - запросы дольше самой большой границы (+Inf)
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+
+    def quantile(self, q):
+        """Оценка квантиля по гистограмме: верхняя граница корзины, в которую он попадает"""
+        rank = q * self.requests
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max_seconds
+
+
+class RequestMetrics:
+    """Метрики запросов по эндпоинтам Flask: число, ошибки 5xx, гистограмма задержек,
+    число SQL-запросов и суммарное время в базе.
+
+    Данные хранятся в памяти процесса; на запрос приходится несколько операций
+    со счетчиками под одной блокировкой. При нескольких рабочих процессах (wsgi.py)
+    у каждого свои счетчики: все серии Prometheus помечены меткой pid.
+    """
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Рабочий процесс считает только свои запросы с момента запуска
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.started_at = time.time()
+
+    def init_app(self, app):
+        # METRICS_ENABLED проверяется в каждом запросе, а не здесь: настройки приложения
+        # могут быть применены (create_app) уже после регистрации обработчиков.
+        # Слушатель на классе Engine охватывает оба движка global_init: запись и чтение
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute', _before_cursor_execute)
+        sa.event.listen(sa.engine.Engine, 'after_cursor_execute', _after_cursor_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._remember_status)
+        # teardown_request выполняется и после потоковых ответов (stream_with_context),
+        # когда тело уже отдано клиенту
+        app.teardown_request(self._finish_request)
+
+    @staticmethod
+    def _start_request():
+        # Без metrics_start и _current.sql запрос не учитывается ни здесь, ни в слушателях SQL
+        if not current_app.config.get('METRICS_ENABLED', True):
+            return
+        g.metrics_start = time.perf_counter()
+        _current.sql = [0, 0.0]
+
+    @staticmethod
+    def _remember_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _finish_request(self, exception=None):
+        start = g.pop('metrics_start', None)
+        sql = getattr(_current, 'sql', None)
+        _current.sql = None
+        if start is None:
+            return
+
+        elapsed = time.perf_counter() - start
+        failed = exception is not None or g.pop('metrics_status', 500) >= 500
+        self.record(request.endpoint or '<unmatched>', elapsed, failed, *(sql or (0, 0.0)))
+
+    def record(self, endpoint, seconds, failed=False, sql_statements=0, sql_seconds=0.0):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            stats.requests += 1
+            stats.errors += failed
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            stats.sql_statements += sql_statements
+            stats.sql_seconds += sql_seconds
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        """Сводка по эндпоинтам для страницы /admin/metrics, самые затратные по времени первыми"""
+        with self._lock:
+            rows = []
+            for endpoint, stats in self._endpoints.items():
+                rows.append({
+                    'endpoint': endpoint,
+                    'requests': stats.requests,
+                    'errors': stats.errors,
+                    'mean_ms': stats.seconds / stats.requests * 1000,
+                    'p50_ms': stats.quantile(0.50) * 1000,
+                    'p95_ms': stats.quantile(0.95) * 1000,
+                    'max_ms': stats.max_seconds * 1000,
+                    'total_seconds': stats.seconds,
+                    'sql_per_request': stats.sql_statements / stats.requests,
+                    'sql_ms_per_request': stats.sql_seconds / stats.requests * 1000,
+                    'sql_share': stats.sql_seconds / stats.seconds if stats.seconds else 0.0,
+                })
+        return sorted(rows, key=lambda row: row['total_seconds'], reverse=True)
+
+    def prometheus(self, gauges=None):
+        """Метрики в текстовом формате Prometheus; gauges - {имя: {метка: значение}}"""
+        pid = f'pid="{os.getpid()}"'
+        lines = [
+            '# HELP library_http_request_duration_seconds Время обработки запроса',
+            '# TYPE library_http_request_duration_seconds histogram',
+        ]
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            for endpoint, stats in endpoints:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(f'library_http_request_duration_seconds_bucket'
+                                 f'{{{pid},endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines.append(f'library_http_request_duration_seconds_bucket'
+                             f'{{{pid},endpoint="{endpoint}",le="+Inf"}} {stats.requests}')
+                labels = f'{pid},endpoint="{endpoint}"'
+                lines.append(f'library_http_request_duration_seconds_sum{{{labels}}} {stats.seconds}')
+                lines.append(f'library_http_request_duration_seconds_count{{{labels}}} {stats.requests}')
+
+            counters = [
+                ('library_http_request_errors_total', 'Ответы 5xx и необработанные исключения', 'errors'),
+                ('library_sql_statements_total', 'SQL-запросы, выполненные при обработке запросов',
+                 'sql_statements'),
+                ('library_sql_duration_seconds_total', 'Время выполнения SQL-запросов', 'sql_seconds'),
+            ]
+            for name, help_text, attribute in counters:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for endpoint, stats in endpoints:
+                    lines.append(f'{name}{{{pid},endpoint="{endpoint}"}} {getattr(stats, attribute)}')
+
+        for name, values in (gauges or {}).items():
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in values.items():
+                lines.append(f'{name}{{{pid},{labels}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_current, 'sql', None) is not None:
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    sql = getattr(_current, 'sql', None)
+    starts = conn.info.get('metrics_query_start')
+    if sql is None or not starts:
+        return
+    sql[0] += 1
+    sql[1] += time.perf_counter() - starts.pop()
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,134 @@
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from data.db_models.db_session import create_session, global_init, remove_session
+from data.db_models.job_runs import JobRun
+from data.db_models.loans import Loan
+from data.db_models.reservations import Reservation
+from data.scripts import circulation
+
+# Сколько дней резервация ждет выдачи, прежде чем истечь
+RESERVATION_TTL_DAYS = 3
+# Период запуска фоновых задач по умолчанию
+DEFAULT_INTERVAL_SECONDS = 300
+
+
+def mark_overdue_loans(session):
+    """Помечает просроченными активные выдачи с истекшим сроком возврата одним UPDATE"""
+    result = session.execute(
+        sa.update(Loan)
+        .where(Loan.status == 'active', Loan.due_date < datetime.now().date())
+        .values(status='overdue')
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def expire_reservations(session, ttl_days=RESERVATION_TTL_DAYS):
+    """Отменяет давно ожидающие выдачи резервации; их копии уходят следующим в очереди или становятся доступными"""
+    cutoff = datetime.now().date() - timedelta(days=ttl_days)
+    expired_book_ids = session.execute(
+        sa.update(Reservation)
+        .where(Reservation.status == 'pending', Reservation.reservation_date < cutoff)
+        .values(status='expired')
+        .returning(Reservation.book_id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+
+    for book_id in expired_book_ids:
+        circulation.release_reserved_copy(session, book_id)
+    return len(expired_book_ids)
+
+
+JOBS = {
+    'mark_overdue_loans': mark_overdue_loans,
+    'expire_reservations': expire_reservations,
+}
+
+
+def run_job(name):
+    """Выполняет задачу в отдельной транзакции и записывает время и число строк в job_runs"""
+    session = create_session()
+    started_at = datetime.now()
+    start = time.perf_counter()
+    rows_affected, error = 0, None
+
+    try:
+        rows_affected = JOBS[name](session)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        error = str(e)
+
+    duration_ms = (time.perf_counter() - start) * 1000
+    status = f'ошибка: {error}' if error else f'{rows_affected} строк'
+    print(f'[{started_at:%Y-%m-%d %H:%M:%S}] {name}: {status}, {duration_ms:.1f} мс')
+
+    try:
+        session.add(JobRun(
+            job_name=name,
+            started_at=started_at,
+            duration_ms=duration_ms,
+            rows_affected=rows_affected,
+            error=error
+        ))
+        session.commit()
+    finally:
+        remove_session()
+
+    return rows_affected
+
+
+def run_all_jobs():
+    return {name: run_job(name) for name in JOBS}
+
+
+class Scheduler:
+    """Фоновый поток, периодически выполняющий все задачи из JOBS"""
+
+    def __init__(self, interval=DEFAULT_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name='library-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def _loop(self):
+        while True:
+            run_all_jobs()
+            if self._stop_event.wait(self.interval):
+                break
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Фоновые задачи библиотеки (python -m data.scripts.scheduler)')
+    parser.add_argument('--db', default='db/database.db', help='файл базы данных')
+    parser.add_argument('--interval', type=int, default=DEFAULT_INTERVAL_SECONDS, help='период запуска, секунд')
+    parser.add_argument('--once', action='store_true', help='выполнить задачи один раз и выйти')
+    args = parser.parse_args()
+
+    global_init(args.db)
+    if args.once:
+        run_all_jobs()
+    else:
+        scheduler = Scheduler(args.interval)
+        scheduler.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            scheduler.stop()
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from data.db_models import facets
+from data.db_models.books import Book
+from data.db_models.loans import Loan
+from data.db_models.reservations import Reservation
+
+# Сколько жанров показывать в распределении фонда
+GENRES_LIMIT = 100
+
+
+def count_by_status(session, model):
+    """Количество записей по каждому статусу одним GROUP BY запросом"""
+    rows = session.query(model.status, sa.func.count(model.id)).group_by(model.status).all()
+    return {status: count for status, count in rows}
+
+
+def loan_stats(session):
+    """Статистика выдач для страницы admin/loans"""
+    by_status = count_by_status(session, Loan)
+    return {
+        'total': sum(by_status.values()),
+        'active': by_status.get('active', 0),
+        'overdue': by_status.get('overdue', 0),
+        'returned': by_status.get('returned', 0),
+        'by_status': by_status,
+    }
+
+
+def reader_loan_counts(session, reader_ids):
+    """Выдачи на руках и просроченные у каждого читателя одним GROUP BY: {reader_id: (на руках, просрочено)}"""
+    if not reader_ids:
+        return {}
+    rows = session.query(
+        Loan.reader_id,
+        sa.func.count(Loan.id),
+        sa.func.sum(sa.case((Loan.status == 'overdue', 1), else_=0)),
+    ).filter(
+        Loan.reader_id.in_(reader_ids), Loan.status.in_(['active', 'overdue'])
+    ).group_by(Loan.reader_id).all()
+    return {reader_id: (active, overdue) for reader_id, active, overdue in rows}
+
+
+def reservation_stats(session):
+    """Статистика резерваций для страницы admin/reservations"""
+    by_status = count_by_status(session, Reservation)
+    today = session.query(sa.func.count(Reservation.id)).filter(
+        Reservation.reservation_date == datetime.now().date()
+    ).scalar()
+    return {
+        'total': sum(by_status.values()),
+        'pending': by_status.get('pending', 0),
+        'waiting': by_status.get('waiting', 0),
+        'fulfilled': by_status.get('fulfilled', 0),
+        'cancelled': by_status.get('cancelled', 0),
+        'today': today,
+        'by_status': by_status,
+    }
+
+
+def book_stats(session):
+    """Сводка по фонду (названия, копии, отсутствующие книги) и распределение по жанрам"""
+    titles, total_copies, available_copies, no_copies = session.query(
+        sa.func.count(Book.id),
+        sa.func.coalesce(sa.func.sum(Book.total_copies), 0),
+        sa.func.coalesce(sa.func.sum(Book.available_copies), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((Book.available_copies == 0, 1), else_=0)), 0),
+    ).one()
+
+    # Распределение по жанрам - из счетчиков фасетов, без GROUP BY по книгам
+    genres = facets.top_facets(session, ('genre',), limit=GENRES_LIMIT)['genre']
+
+    return {
+        'titles': titles,
+        'total_copies': total_copies,
+        'available_copies': available_copies,
+        'borrowed_copies': total_copies - available_copies,
+        'no_copies': no_copies,
+        'genres': [(genre, count) for genre, count, available in genres],
+    }
@@ -0,0 +1,246 @@
+import heapq
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+import sqlalchemy as sa
+
+from data.db_models.books import Book
+from data.db_models.db_session import create_read_session, remove_session
+from data.db_models.loans import Loan
+from data.db_models.users import fold_search_text
+from data.scripts._utils import PREFIX_END
+
+# Поля книг, по которым строятся подсказки
+FIELDS = ('title', 'author', 'publisher', 'genre')
+# Наибольшее число подсказок по одному полю
+TOP_K = 10
+# Диапазоны префикса длиннее этого не просматриваются при каждом запросе: их лучшие
+# значения кэшируются и поддерживаются при изменениях
+SCAN_LIMIT = 256
+# Длина префиксов, лучшие значения которых считаются сразу при загрузке
+WARM_PREFIX_LENGTH = 2
+# Период полной перезагрузки: веса по числу выдач и изменения книг в других процессах
+REFRESH_SECONDS = 600
+
+
+def _rank(weights):
+    """Ключ сортировки подсказок: больший вес раньше, при равном весе - по алфавиту"""
+    return lambda key: (-weights[key], key)
+
+
+class PrefixIndex:
+    """Подсказки по одному полю: отсортированный список нормализованных значений,
+    поиск диапазона префикса через bisect и кэш лучших значений длинных диапазонов"""
+
+    def __init__(self, weights, labels):
+        self.weights = weights
+        self.labels = labels
+        self.keys = sorted(weights)
+        self._top = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _range(self, prefix):
+        return bisect_left(self.keys, prefix), bisect_left(self.keys, prefix + PREFIX_END)
+
+    def _scan(self, lo, hi, limit):
+        return heapq.nsmallest(limit, self.keys[lo:hi], key=_rank(self.weights))
+
+    def warm(self, max_length=WARM_PREFIX_LENGTH):
+        """Кэширует лучшие значения всех длинных диапазонов для префиксов до max_length символов"""
+        self._top[''] = self._scan(0, len(self.keys), TOP_K)
+        for length in range(1, max_length + 1):
+            lo = 0
+            while lo < len(self.keys):
+                prefix = self.keys[lo][:length]
+                if len(prefix) < length:
+                    lo += 1
+                    continue
+                hi = bisect_left(self.keys, prefix + PREFIX_END, lo)
+                if hi - lo > SCAN_LIMIT:
+                    self._top[prefix] = self._scan(lo, hi, TOP_K)
+                lo = hi
+
+    def lookup(self, prefix, limit):
+        lo, hi = self._range(prefix)
+        if hi - lo <= SCAN_LIMIT:
+            keys = self._scan(lo, hi, limit)
+        else:
+            top = self._top.get(prefix)
+            if top is None:
+                top = self._top[prefix] = self._scan(lo, hi, TOP_K)
+            keys = top[:limit]
+        return [(self.labels[key], self.weights[key]) for key in keys]
+
+    def add(self, label, delta):
+        """Меняет вес значения label на delta; значение с нулевым весом удаляется"""
+        key = fold_search_text(label)
+        if not key:
+            return
+        weight = self.weights.get(key, 0) + delta
+        if key not in self.weights:
+            insort(self.keys, key)
+        if weight > 0:
+            self.weights[key] = weight
+            self.labels.setdefault(key, label)
+        else:
+            self.weights.pop(key, None)
+            self.labels.pop(key, None)
+            del self.keys[bisect_left(self.keys, key)]
+
+        # Кэш лучших значений префиксов key: рост веса уточняет список на месте, при
+        # уменьшении веса значения из списка на его место может прийти любое - кэш сбрасывается
+        for i in range(len(key) + 1):
+            top = self._top.get(key[:i])
+            if top is None:
+                continue
+            if delta < 0 and key in top:
+                del self._top[key[:i]]
+            elif delta > 0:
+                if key not in top:
+                    top.append(key)
+                top.sort(key=_rank(self.weights))
+                del top[TOP_K:]
+
+
+class SuggestIndex:
+    """Подсказки поиска по названиям, авторам, издательствам и жанрам в памяти процесса.
+
+    Вес значения - число выдач его книг плюс число самих книг. Индекс загружается при
+    запуске, изменения книг в этом процессе применяются сразу (book_changed), а полная
+    перезагрузка раз в refresh_seconds подтягивает новые выдачи и изменения из других процессов.
+    """
+
+    def __init__(self, refresh_seconds=REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.loaded_at = None
+        self.load_ms = None
+        self._fields = None
+        # Вклад книг в веса на момент загрузки: {book_id: число выдач + 1}, только для книг
+        # с выдачами (у остальных вклад 1); новые выдачи учитываются лишь перезагрузкой
+        self._book_weights = {}
+        self._reset_locks()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_locks)
+
+    def _reset_locks(self):
+        # После fork поток перезагрузки родителя в ребенке не существует: его блокировки
+        # и флаг перезагрузки создаются заново, загруженный индекс остается
+        self._lock = threading.Lock()
+        self._load_lock = threading.RLock()
+        self._refreshing = False
+
+    @staticmethod
+    def build(session):
+        """Поля индекса по данным базы и вклад книг с выдачами ({book_id: вес}): книги
+        читаются порциями, выдачи - одним GROUP BY"""
+        loans = dict(session.execute(
+            sa.select(Loan.book_id, sa.func.count(Loan.id)).group_by(Loan.book_id)
+        ).all())
+        weights = {field: defaultdict(int) for field in FIELDS}
+        labels = {field: {} for field in FIELDS}
+        book_weights = {}
+
+        rows = session.execute(sa.select(Book.id, *(getattr(Book, field) for field in FIELDS)),
+                               execution_options={'yield_per': 10000})
+        for book_id, *values in rows:
+            weight = loans.get(book_id, 0) + 1
+            if weight > 1:
+                book_weights[book_id] = weight
+            for field, value in zip(FIELDS, values):
+                key = fold_search_text(value)
+                if key:
+                    weights[field][key] += weight
+                    labels[field].setdefault(key, value)
+
+        fields = {field: PrefixIndex(dict(weights[field]), labels[field]) for field in FIELDS}
+        for index in fields.values():
+            index.warm()
+        return fields, book_weights
+
+    def load(self, session=None):
+        """Строит индекс заново и подменяет им текущий; поиск во время загрузки не блокируется"""
+        with self._load_lock:
+            start = time.perf_counter()
+            fields, book_weights = self.build(session or create_read_session())
+            with self._lock:
+                self._fields = fields
+                self._book_weights = book_weights
+                self.loaded_at = time.monotonic()
+                self.load_ms = (time.perf_counter() - start) * 1000
+
+    def refresh_async(self):
+        """Перезагружает индекс в фоновом потоке (со своей сессией), если перезагрузка еще не идет"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.load()
+            finally:
+                self._refreshing = False
+                remove_session()
+
+        threading.Thread(target=refresh, name='suggest-index-refresh', daemon=True).start()
+
+    def ensure_loaded(self):
+        """Загружает индекс при первом обращении и запускает фоновую перезагрузку устаревшего"""
+        if self._fields is None:
+            with self._load_lock:
+                if self._fields is None:
+                    self.load()
+        elif time.monotonic() - self.loaded_at > self.refresh_seconds:
+            self.refresh_async()
+
+    def suggest(self, prefix, fields=FIELDS, limit=TOP_K):
+        """Лучшие значения каждого поля, начинающиеся с prefix: {поле: [(значение, вес), ...]}"""
+        key = fold_search_text(prefix) or ''
+        limit = min(limit, TOP_K)
+        with self._lock:
+            return {field: self._fields[field].lookup(key, limit) for field in fields}
+
+    def book_changed(self, book_id, old=None, new=None):
+        """Применяет изменение книги book_id: old и new - значения полей до и после
+        ({поле: значение} или None для созданной/удаленной книги).
+
+        Вес переносится тот, с которым книга вошла в индекс при загрузке: выдачи после
+        загрузки в весах значений еще не учтены, и вычитать их нельзя.
+        """
+        if self._fields is None:
+            return
+        with self._lock:
+            if new is None:
+                weight = self._book_weights.pop(book_id, 1)
+            else:
+                weight = self._book_weights.get(book_id, 1)
+            for field in FIELDS:
+                before = (old or {}).get(field)
+                after = (new or {}).get(field)
+                if fold_search_text(before) == fold_search_text(after):
+                    continue
+                if before:
+                    self._fields[field].add(before, -weight)
+                if after:
+                    self._fields[field].add(after, weight)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self._fields is not None,
+                'load_ms': self.load_ms,
+                'values': {field: len(index) for field, index in (self._fields or {}).items()},
+            }
+
+
+def book_values(book):
+    """Значения полей подсказок книги для SuggestIndex.book_changed"""
+    return {field: getattr(book, field) for field in FIELDS}
+
+
+suggest_index = SuggestIndex()
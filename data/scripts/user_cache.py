@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+
+# Колонки пользователя, которые нужны шаблонам и представлениям через current_user
+CACHED_COLUMNS = ('id', 'full_name', 'email', 'birthday', 'is_admin', 'is_active', 'created_at')
+
+
+class CachedUser(UserMixin):
+    """Снимок колонок пользователя, не привязанный к сессии; безопасен для общих потоков"""
+    is_active = None
+
+    def __init__(self, user):
+        for column in CACHED_COLUMNS:
+            setattr(self, column, getattr(user, column))
+
+
+class UserCache:
+    """Ограниченный кэш пользователей для load_user: LRU-вытеснение и время жизни записи.
+
+    Кэш локален для процесса, поэтому после изменения пользователя запись нужно явно
+    сбросить через invalidate(); в других процессах она устареет не позже чем через ttl секунд.
+    При ttl <= 0 кэш выключен: пользователь загружается в каждом запросе (несколько
+    рабочих процессов, где блокировка должна действовать сразу во всех).
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        # Поколения записей: invalidate() увеличивает поколение пользователя, clear() - общее.
+        # Снимок, загруженный до сброса, не сохраняется и не живет в кэше весь ttl
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id, loader):
+        """Пользователь из кэша; при промахе загружается через loader() и сохраняется"""
+        if self.ttl <= 0:
+            user = loader()
+            return CachedUser(user) if user is not None else None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._epoch, self._generations.get(user_id, 0)
+
+        user = loader()
+        if user is None:
+            return None
+
+        cached = CachedUser(user)
+        with self._lock:
+            if generation != (self._epoch, self._generations.get(user_id, 0)):
+                # Пока пользователь загружался, запись сбросили: снимок мог устареть
+                return cached
+            self._entries[user_id] = (now + self.ttl, cached)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return cached
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else 0.0,
+            }
+
+
+user_cache = UserCache()
@@ -0,0 +1,45 @@
+import sqlalchemy as sa
+
+from data.db_models.users import User, fold_search_text
+from data.scripts._utils import PREFIX_END
+
+
+def prefix_condition(column, prefix):
+    """column начинается с prefix; в отличие от LIKE 'prefix%' использует индекс по column"""
+    return sa.and_(column >= prefix, column < prefix + PREFIX_END)
+
+
+def prefix_match(text):
+    """Совпадение по префиксу фамилии (начала полного имени), имени или почты.
+
+    Каждая ветка OR - диапазон по своему индексу (ix_users_search_*).
+    """
+    return sa.or_(
+        prefix_condition(User.search_name, text),
+        prefix_condition(User.search_given_name, text),
+        prefix_condition(User.search_email, text),
+    )
+
+
+def substring_match(text):
+    """Каждое слово запроса встречается где-то в имени или почте (полный просмотр таблицы)"""
+    return sa.and_(*(
+        sa.or_(sa.func.instr(User.search_name, word) > 0, sa.func.instr(User.search_email, word) > 0)
+        for word in text.split()
+    ))
+
+
+def search_users(query, search, paginate):
+    """Страница пользователей запроса query, найденных по search; paginate(query) -> страница.
+
+    Сначала ищем по префиксу (по индексу, миллисекунды и на сотнях тысяч читателей);
+    поиск подстроки с просмотром всей таблицы - только если по префиксу ничего не нашлось
+    ("дарья лебедев", часть почты из середины).
+    """
+    text = fold_search_text(search)
+    if not text:
+        return paginate(query)
+    page = paginate(query.filter(prefix_match(text)))
+    if page['items']:
+        return page
+    return paginate(query.filter(substring_match(text)))
@@ -1,27 +1,82 @@
+import contextlib
 import hashlib
+import os
+import sys
 from datetime import datetime, timedelta
 from functools import wraps
 
 import bcrypt
+import click
 import sqlalchemy
+from sqlalchemy.orm import contains_eager, joinedload
 
-from flask import Flask, render_template, redirect, jsonify, request, session, flash, url_for
+from flask import Config as FlaskConfig, Flask, Response, render_template, redirect, jsonify, request, session, \
+    flash, url_for, stream_with_context
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 
+from config import Config, CONFIGS, DevelopmentConfig
+from data.db_models import facets, migrations, search
 from data.db_models.books import Book
-from data.db_models.db_session import global_init, create_session
+from data.db_models.catalog_version import get_catalog_version
+from data.db_models.db_session import global_init, create_session, create_read_session, get_engine, \
+    remove_session, pool_stats
 from data.db_models.loans import Loan
 from data.db_models.reservations import Reservation
 from data.db_models.users import User
-from data.scripts import _utils
-from data.scripts._utils import populate_books_table, paginate, create_users
+from data.scripts import _utils, circulation, export, stats, user_search
+from data.scripts.metrics import request_metrics
+from data.scripts.scheduler import Scheduler
+from data.scripts.suggest import suggest_index, book_values, FIELDS as SUGGEST_FIELDS
+from data.scripts.user_cache import user_cache
+from data.scripts._utils import populate_books_table, paginate, keyset_paginate, create_users, filter_catalog, \
+    sort_catalog, iter_json_array, iter_json_object, iter_gzip, CATALOG_COLUMNS
+
+DB_FILE = Config.DB_FILE
+# Наибольшее число элементов в одном запросе пакетной выдачи, возврата или продления
+MAX_BATCH_SIZE = 500
+# Читателей и книг на одной странице поиска при выдаче
+PICKER_PAGE_SIZE = 20
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'BE.shXML#QvZmqj"7b@n'
+app.config.from_object(Config)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 
+request_metrics.init_app(app)
+
+
+def create_app(config=None):
+    """Настраивает приложение config (класс или имя из config.CONFIGS; по умолчанию -
+    переменная окружения LIBRARY_CONFIG, иначе production) и подключает базу.
+
+    Маршруты регистрируются на app при импорте модуля, поэтому фабрика настраивает и
+    возвращает этот же объект, а движки базы одни на процесс: повторный вызов с другим
+    файлом базы, профилем или пулами - ошибка (global_init), а не тихая работа со
+    старыми движками. Prefork-сервер может вызвать ее в родителе до fork: миграции
+    выполнятся один раз, а унаследованные пулы рабочие процессы сбросят сразу после fork
+    (db_session.dispose_engines) и откроют собственные соединения.
+
+    Индекс подсказок загружается здесь же, до первых запросов: при вызове до fork его
+    получают готовым все рабочие процессы.
+    """
+    if config is None:
+        config = os.environ.get('LIBRARY_CONFIG', 'production')
+    if isinstance(config, str):
+        config = CONFIGS[config]
+    # Настройки применяются к app, только если база подключилась с ними
+    settings = FlaskConfig(app.root_path)
+    settings.from_object(config)
+    if not settings['SECRET_KEY']:
+        raise RuntimeError('Не задан ключ сессий: переменная окружения LIBRARY_SECRET_KEY')
+
+    global_init(settings['DB_FILE'], profile=settings['DB_PROFILE'], pool_size=settings['DB_POOL_SIZE'],
+                read_pool_size=settings['DB_READ_POOL_SIZE'])
+    app.config.update(settings)
+    user_cache.ttl = app.config['USER_CACHE_TTL']
+    suggest_index.load()
+    return app
+
 
 def admin_required(f):
     @wraps(f)
@@ -41,8 +96,49 @@ def admin_required(f):
 
 @login_manager.user_loader
 def load_user(user_id):
-    db_sess = create_session()
-    return db_sess.get(User, user_id)
+    user_id = int(user_id)
+    return user_cache.get(user_id, lambda: create_session().get(User, user_id))
+
+
+@app.teardown_appcontext
+def shutdown_session(exception=None):
+    """Одна сессия на запрос (общая с load_user): закрываем ее и откатываем незавершенное"""
+    remove_session()
+
+
+def catalog_etag(session):
+    """Сильный ETag ответов каталога: версия каталога и кодирование ответа"""
+    encoding = '-gzip' if 'gzip' in request.accept_encodings else ''
+    return f'catalog-{get_catalog_version(session)}{encoding}'
+
+
+def not_modified(etag):
+    """Ответ 304, если у клиента уже есть актуальная версия каталога, иначе None"""
+    if not request.if_none_match.contains(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def stream_response(chunks, mimetype):
+    """Потоковый ответ из текстовых частей; сжимается gzip, если клиент его принимает"""
+    if 'gzip' in request.accept_encodings:
+        response = Response(stream_with_context(iter_gzip(chunks)), mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def json_stream_response(chunks, etag=None):
+    """Потоковый JSON-ответ; сжимается gzip, если клиент его принимает"""
+    response = stream_response(chunks, 'application/json')
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/')
@@ -121,6 +217,7 @@ def change():
             db_user.birthday = form.birthday.data
 
         session.commit()
+        user_cache.invalidate(db_user.id)
 
         return redirect('/profile')
     return render_template('change.html', form=form)
@@ -145,6 +242,7 @@ def change_email():
         db_user = session.query(User).filter(User.email == current_user.email).first()
         db_user.email = form.new_email.data
         session.commit()
+        user_cache.invalidate(db_user.id)
 
         return redirect('/profile')
     return render_template('change_email.html', form=form)
@@ -178,6 +276,7 @@ def change_password():
         db_user.salt = salt
 
         session.commit()
+        user_cache.invalidate(db_user.id)
 
         return redirect('/profile')
     return render_template('change_password.html', form=form)
@@ -196,6 +295,7 @@ def confirmed_delete():
     db_user = session.query(User).filter(User.email == current_user.email).first()
     session.delete(db_user)
     session.commit()
+    user_cache.invalidate(current_user.id)
 
     return redirect('/')
 
@@ -208,24 +308,52 @@ def catalog():
 @app.route('/api/books')
 def get_books():
     try:
-        session = create_session()
-        books = session.query(Book).all()
-
-        books_list = []
-        for book in books:
-            books_list.append({
-                'id': book.id,
-                'title': book.title,
-                'author': book.author,
-                'year': book.publication_year,
-                'publisher': book.publisher,
-                'genre': book.genre,
-                'total_copies': book.total_copies,
-                'available_copies': book.available_copies,
-                'is_available': book.available_copies > 0,
-            })
-
-        return jsonify(books_list)
+        session = create_read_session()
+
+        page = request.args.get('page', 1, type=int)
+        per_page = min(max(request.args.get('per_page', 6, type=int), 1), 100)
+        catalog_filter = request.args.get('filter', 'all')
+        sort = request.args.get('sort', 'title')
+        search_query = request.args.get('q', '').strip()
+
+        if catalog_filter not in _utils.CATALOG_FILTERS:
+            return jsonify({'error': f'Неизвестный фильтр: {catalog_filter}'}), 400
+
+        etag = catalog_etag(session)
+        if response := not_modified(etag):
+            return response
+
+        query = filter_catalog(session.query(*CATALOG_COLUMNS), catalog_filter)
+        if search.to_match_expression(search_query):
+            query = query.filter(
+                sqlalchemy.or_(
+                    Book.id.in_(search.matching_book_ids(search_query)),
+                    Book.publication_year == int(search_query) if search_query.isdigit() else False
+                )
+            )
+
+        books = paginate(sort_catalog(query, sort), page=page, per_page=per_page)
+
+        books_list = ({
+            'id': book.id,
+            'title': book.title,
+            'author': book.author,
+            'year': book.publication_year,
+            'publisher': book.publisher,
+            'genre': book.genre,
+            'total_copies': book.total_copies,
+            'available_copies': book.available_copies,
+            'is_available': book.available_copies > 0,
+        } for book in books['items'])
+
+        return json_stream_response(iter_json_object({
+            'page': books['page'],
+            'per_page': per_page,
+            'total': books['total_items'],
+            'total_pages': books['total_pages'],
+            'has_prev': books['has_prev'],
+            'has_next': books['has_next'],
+        }, 'books', books_list), etag=etag)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -233,33 +361,71 @@ def get_books():
 
 @app.route('/api/books/search')
 def search_books():
-    session = create_session()
+    session = create_read_session()
     search_query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
 
     if not search_query:
         return jsonify([])
 
-    books = session.query(Book).filter(
-        sqlalchemy.or_(
-            Book.title.ilike(f'%{search_query}%'),
-            Book.author.ilike(f'%{search_query}%'),
-            Book.publisher.ilike(f'%{search_query}%'),
-            Book.genre.ilike(f'%{search_query}%')
-        )
-    ).all()
-
-    result = []
-    for book in books:
-        result.append({
-            'id': book.id,
-            'title': book.title,
-            'author': book.author,
-            'year': book.publication_year,
-            'publisher': book.publisher,
-            'available': book.available_copies > 0
-        })
-
-    return jsonify(result)
+    etag = catalog_etag(session)
+    if response := not_modified(etag):
+        return response
+
+    books = search.search_books(session, search_query, limit=limit, offset=offset)
+
+    return json_stream_response(iter_json_array({
+        'id': book.id,
+        'title': book.title,
+        'author': book.author,
+        'year': book.publication_year,
+        'publisher': book.publisher,
+        'available': book.available_copies > 0
+    } for book in books), etag=etag)
+
+
+@app.route('/api/suggest')
+def suggest():
+    """Подсказки поиска по префиксу: самые востребованные названия, авторы, издательства и жанры.
+
+    Параметры: q (префикс), fields (через запятую, по умолчанию все поля), limit (до 10).
+    Отвечает индекс в памяти процесса, база при поиске не читается.
+    """
+    fields = tuple(request.args.get('fields', ','.join(SUGGEST_FIELDS)).split(','))
+    if not set(fields) <= set(SUGGEST_FIELDS):
+        return jsonify({'error': f'Поля подсказок: {", ".join(SUGGEST_FIELDS)}'}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 10)
+
+    suggest_index.ensure_loaded()
+    suggestions = suggest_index.suggest(request.args.get('q', ''), fields, limit)
+    return jsonify({field: [{'value': value, 'weight': weight} for value, weight in values]
+                    for field, values in suggestions.items()})
+
+
+@app.route('/api/facets')
+def get_facets():
+    """Фасеты каталога: первые значения жанров, авторов, издательств и десятилетий по числу книг.
+
+    Параметры: facets (через запятую, по умолчанию все), limit (до 100). Счетчики хранятся
+    в таблице book_facets и поддерживаются триггерами, GROUP BY по книгам не выполняется.
+    """
+    names = tuple(request.args.get('facets', ','.join(facets.FACETS)).split(','))
+    if not set(names) <= set(facets.FACETS):
+        return jsonify({'error': f'Фасеты: {", ".join(facets.FACETS)}'}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+
+    session = create_read_session()
+    etag = catalog_etag(session)
+    if response := not_modified(etag):
+        return response
+
+    response = jsonify({name: [{'value': value, 'books': books, 'available': available}
+                               for value, books, available in values]
+                        for name, values in facets.top_facets(session, names, limit).items()})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/api/books/<int:book_id>/reserve', methods=['POST'])
@@ -268,44 +434,78 @@ def reserve_book(book_id):
     session = create_session()
     try:
         user_id = current_user.id
-        book = session.query(Book).filter(Book.id == book_id).first()
 
         # Проверка, не зарезервировал ли пользователь уже эту книгу
-        existing_reservation = session.query(Reservation).filter_by(
-            reader_id=user_id,
-            book_id=book_id,
-            status='pending'
+        existing_reservation = session.query(Reservation).filter(
+            Reservation.reader_id == user_id,
+            Reservation.book_id == book_id,
+            Reservation.status.in_(['pending', 'waiting'])
         ).first()
 
         if existing_reservation:
             return jsonify({'error': 'Вы уже зарезервировали эту книгу'}), 400
 
-        if book.available_copies == 0:
-            return jsonify({'error': 'Книг не осталось в наличии'}), 400
+        # Если свободных копий нет, читатель встает в очередь на книгу
+        if circulation.reserve_copy(session, book_id):
+            status = 'pending'
+        elif session.get(Book, book_id) is None:
+            return jsonify({'error': 'Книга не найдена'}), 404
+        else:
+            status = 'waiting'
 
         # Создание резервации
         reservation = Reservation(
             reader_id=user_id,
             book_id=book_id,
             reservation_date=datetime.now(),
-            status='pending'
+            status=status
         )
-
-        book.available_copies -= 1
-        book.reserved_copies += 1
         session.add(reservation)
         session.commit()
 
-        return jsonify({
+        result = {
             'message': 'Книга зарезервирована',
+            'status': status,
             'reservation_date': reservation.reservation_date.strftime('%Y-%m-%d')
-        })
-
+        }
+        if status == 'waiting':
+            result['position'] = circulation.queue_position(session, book_id, reservation.id)
+            result['message'] = f"Свободных копий нет, вы в очереди на книгу: место {result['position']}"
+        return jsonify(result)
+
+    except sqlalchemy.exc.IntegrityError:
+        # Параллельный запрос того же читателя успел создать резервацию (ux_reservation_open);
+        # откат возвращает и зарезервированную копию
+        session.rollback()
+        return jsonify({'error': 'Вы уже зарезервировали эту книгу'}), 400
     except Exception as e:
         session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/books/<int:book_id>/queue')
+@login_required
+def book_queue(book_id):
+    """Резервация текущего читателя на книгу и его место в очереди"""
+    session = create_read_session()
+
+    reservation = session.query(Reservation.id, Reservation.status).filter(
+        Reservation.reader_id == current_user.id,
+        Reservation.book_id == book_id,
+        Reservation.status.in_(['pending', 'waiting'])
+    ).first()
+
+    result = {'book_id': book_id, 'queue_length': circulation.queue_length(session, book_id)}
+    if reservation is None:
+        return jsonify({**result, 'status': None, 'position': None}), 404
+
+    result['status'] = reservation.status
+    # Для отложенной копии (pending) места в очереди нет: книгу можно забирать
+    result['position'] = circulation.queue_position(session, book_id, reservation.id) \
+        if reservation.status == 'waiting' else None
+    return jsonify(result)
+
+
 @app.route('/admin')
 @admin_required
 def admin_dashboard():
@@ -321,15 +521,12 @@ def admin_dashboard():
 
     pending_reservations = session.query(Reservation).filter_by(status='pending').count()
 
-    recent_loans = session.query(Loan).order_by(Loan.loan_date.desc()).limit(10).all()
-    recent_reservations = session.query(Reservation).order_by(
-        Reservation.reservation_date.desc()
+    recent_loans = session.query(Loan).options(joinedload(Loan.reader), joinedload(Loan.book)).order_by(
+        Loan.loan_date.desc()
     ).limit(10).all()
-
-    for loan in session.query(Loan).filter_by(status='active').all():
-        if loan.is_overdue:
-            loan.status = 'overdue'
-    session.commit()
+    recent_reservations = session.query(Reservation).options(
+        joinedload(Reservation.reader), joinedload(Reservation.book)
+    ).order_by(Reservation.reservation_date.desc()).limit(10).all()
 
     return render_template('admin/dashboard.html',
                            total_users=total_users,
@@ -341,6 +538,45 @@ def admin_dashboard():
                            recent_reservations=recent_reservations)
 
 
+def runtime_gauges():
+    """Текущее состояние пулов соединений и кэша пользователей для /admin/metrics"""
+    pools = pool_stats()
+    cache = user_cache.stats()
+    gauges = {
+        f'library_db_pool_{name}': {f'pool="{pool}"': values[name] for pool, values in pools.items()}
+        for name in ('size', 'checked_in', 'checked_out', 'overflow')
+    }
+    gauges.update({f'library_user_cache_{name}': {'cache="users"': value} for name, value in cache.items()})
+    return pools, cache, gauges
+
+
+@app.route('/admin/metrics')
+@admin_required
+def admin_metrics():
+    """Метрики запросов и SQL по эндпоинтам, состояние пулов и кэша пользователей"""
+    pools, cache, gauges = runtime_gauges()
+    return render_template('admin/metrics.html',
+                           endpoints=request_metrics.snapshot(),
+                           started_at=datetime.fromtimestamp(request_metrics.started_at),
+                           pid=os.getpid(),
+                           pools=pools,
+                           cache=cache)
+
+
+@app.route('/admin/metrics/prometheus')
+@admin_required
+def admin_metrics_prometheus():
+    """Те же метрики в текстовом формате Prometheus.
+
+    Доступны только с сессией администратора: сборщику нужна cookie сессии (или прокси,
+    добавляющий ее). Под wsgi.py каждый запрос обслуживает один из рабочих процессов,
+    и ответ содержит только его счетчики (метка pid): один опрос не видит остальные
+    процессы, а после перезапуска процесса его счетчики начинаются с нуля.
+    """
+    pools, cache, gauges = runtime_gauges()
+    return Response(request_metrics.prometheus(gauges), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/admin/users')
 @admin_required
 def admin_users():
@@ -350,17 +586,11 @@ def admin_users():
     search = request.args.get('search', '')
     page = request.args.get('page', 1, type=int)
 
-    query = session.query(User)
-
-    if search:
-        query = query.filter(
-            sqlalchemy.or_(
-                User.full_name.ilike(f'%{search}%'),
-                User.email.ilike(f'%{search}%')
-            )
-        )
-
-    users = paginate(query.order_by(User.created_at.desc()), page=page, per_page=20)
+    users = user_search.search_users(
+        session.query(User), search,
+        lambda query: keyset_paginate(query, User.created_at, User.id, cursor=request.args.get('cursor'),
+                                      page=page, per_page=20)
+    )
 
     return render_template('admin/users.html', users=users, search=search)
 
@@ -373,28 +603,33 @@ def admin_user_detail(user_id):
 
     user = session.query(User).get(user_id)
 
-    active_loans = session.query(Loan).filter_by(
+    # Книги выдач и резерваций загружаются в тех же запросах, а не по одной на строку
+    active_loans = session.query(Loan).options(joinedload(Loan.book)).filter_by(
         reader_id=user_id,
         status='active'
     ).order_by(Loan.due_date).all()
 
-    overdue_loans = session.query(Loan).filter_by(
+    overdue_loans = session.query(Loan).options(joinedload(Loan.book)).filter_by(
         reader_id=user_id,
         status='overdue'
     ).order_by(Loan.due_date).all()
 
-    returned_loans = session.query(Loan).filter_by(
+    returned_loans = session.query(Loan).options(joinedload(Loan.book)).filter_by(
         reader_id=user_id,
         status='returned'
     ).order_by(Loan.return_date.desc()).limit(20).all()
 
-    active_reservations = session.query(Reservation).filter_by(
+    active_reservations = session.query(Reservation).options(joinedload(Reservation.book)).filter_by(
         reader_id=user_id,
         status='pending'
     ).order_by(Reservation.reservation_date.desc()).all()
 
+    # Счетчик вместо user.loans: не загружаем всю историю выдач читателя
+    total_loans = session.query(sqlalchemy.func.count(Loan.id)).filter(Loan.reader_id == user_id).scalar()
+
     return render_template('admin/user_detail.html',
                            user=user,
+                           total_loans=total_loans,
                            active_loans=active_loans,
                            overdue_loans=overdue_loans,
                            returned_loans=returned_loans,
@@ -410,17 +645,19 @@ def admin_loans():
     status_filter = request.args.get('status', 'active')
     page = request.args.get('page', 1, type=int)
 
-    query = session.query(Loan).join(User).join(Book)
-    all_loans = paginate(query.order_by(Loan.loan_date.desc()), page=page, per_page=len(session.query(Loan).all())+1)
+    query = session.query(Loan).join(Loan.reader).join(Loan.book).options(
+        contains_eager(Loan.reader), contains_eager(Loan.book)
+    )
     if status_filter != 'all':
         query = query.filter(Loan.status == status_filter)
 
-    loans = paginate(query.order_by(Loan.loan_date.desc()), page=page, per_page=20)
+    loans = keyset_paginate(query, Loan.loan_date, Loan.id, cursor=request.args.get('cursor'),
+                            page=page, per_page=20)
 
     return render_template('admin/loans.html',
                            loans=loans,
                            status_filter=status_filter,
-                           all_loans=all_loans)
+                           loan_stats=stats.loan_stats(session))
 
 
 @app.route('/admin/loans/create', methods=['GET', 'POST'])
@@ -440,7 +677,7 @@ def admin_create_loan():
         if not user or not book:
             flash('Пользователь или книга не найдены', 'danger')
             return redirect(url_for('admin_create_loan'))
-        if not book.available_copies > 0:
+        if not circulation.checkout_copy(session, book.id):
             flash('Книга недоступна для выдачи', 'danger')
             return redirect(url_for('admin_create_loan'))
 
@@ -452,47 +689,123 @@ def admin_create_loan():
             status='active'
         )
 
-        book.available_copies -= 1
-
         session.add(loan)
         session.commit()
 
         flash(f'Книга "{book.title}" выдана пользователю {user.full_name}', 'success')
         return redirect(url_for('admin_loans'))
 
-    users = session.query(User).filter_by(is_active=True).order_by(User.full_name).all()
-    available_books = session.query(Book).filter(Book.available_copies > 0).order_by(Book.title).all()
-
     default_due_date = (datetime.now() + timedelta(days=14)).strftime('%Y-%m-%d')
 
+    # Читатель и книга выбираются поиском через admin_pick_users/admin_pick_books; страница
+    # загружает только предвыбранных по ссылке (?user_id=, ?book_id=)
+    selected_user = selected_book = None
+    user_id = request.args.get('user_id', type=int)
+    if user_id:
+        user = session.get(User, user_id)
+        if user and user.is_active:
+            selected_user = picker_user(user, stats.reader_loan_counts(session, [user.id]))
+    book_id = request.args.get('book_id', type=int)
+    if book_id:
+        book = session.get(Book, book_id)
+        if book and book.available_copies > 0:
+            selected_book = picker_book(book)
+
     return render_template('admin/create_loan.html',
-                           users=users,
-                           available_books=available_books,
+                           selected_user=selected_user,
+                           selected_book=selected_book,
+                           picker_page_size=PICKER_PAGE_SIZE,
                            default_due_date=default_due_date)
 
 
+def picker_user(user, loan_counts):
+    """Читатель для выбора при выдаче; loan_counts - результат stats.reader_loan_counts"""
+    active, overdue = loan_counts.get(user.id, (0, 0))
+    return {
+        'id': user.id,
+        'name': user.full_name,
+        'email': user.email,
+        'active_loans': active,
+        'overdue_loans': overdue,
+    }
+
+
+def picker_book(book):
+    """Книга для выбора при выдаче"""
+    return {
+        'id': book.id,
+        'title': book.title,
+        'author': book.author,
+        'genre': book.genre,
+        'year': book.publication_year,
+        'location': book.location,
+        'total_copies': book.total_copies,
+        'available_copies': book.available_copies,
+    }
+
+
+def picker_response(page, items):
+    return jsonify({'items': items, 'has_next': page['has_next'], 'next_cursor': page['next_cursor']})
+
+
+@app.route('/admin/api/users')
+@admin_required
+def admin_pick_users():
+    """Активные читатели для выбора при выдаче: поиск по префиксу фамилии, имени или почты (q),
+    страницы по курсору (cursor), выдачи на руках и просроченные - одним запросом на страницу"""
+    session = create_read_session()
+    columns = session.query(User.id, User.full_name, User.email, User.search_name).filter(
+        User.is_active == True  # noqa: E712
+    )
+    page = user_search.search_users(
+        columns, request.args.get('q', ''),
+        lambda query: keyset_paginate(query, User.search_name, User.id, cursor=request.args.get('cursor'),
+                                      per_page=PICKER_PAGE_SIZE, descending=False)
+    )
+    loan_counts = stats.reader_loan_counts(session, [user.id for user in page['items']])
+    return picker_response(page, [picker_user(user, loan_counts) for user in page['items']])
+
+
+@app.route('/admin/api/books')
+@admin_required
+def admin_pick_books():
+    """Книги со свободными копиями для выбора при выдаче: полнотекстовый поиск (q),
+    страницы по курсору (cursor) в порядке названий"""
+    session = create_read_session()
+    search_query = request.args.get('q', '').strip()
+
+    query = session.query(
+        Book.id, Book.title, Book.author, Book.genre, Book.publication_year, Book.location,
+        Book.total_copies, Book.available_copies
+    ).filter(Book.available_copies > 0)
+    if search.to_match_expression(search_query):
+        query = query.filter(Book.id.in_(search.matching_book_ids(search_query)))
+
+    page = keyset_paginate(query, Book.title, Book.id, cursor=request.args.get('cursor'),
+                           per_page=PICKER_PAGE_SIZE, descending=False)
+    return picker_response(page, [picker_book(book) for book in page['items']])
+
+
 @app.route('/admin/loans/<int:loan_id>/return', methods=['POST'])
 @admin_required
 def admin_return_loan(loan_id):
     """Отметить книгу как возвращенную"""
     session = create_session()
 
-    loan = session.query(Loan).get(loan_id)
-    book = session.query(Book).get(loan.book_id)
-
-    if loan.status == 'returned':
+    # Закрывается только еще не возвращенная выдача: повторный возврат не добавит копию
+    book_id = circulation.close_loan(session, loan_id)
+    if book_id is None:
         flash('Книга уже возвращена', 'warning')
         return redirect(url_for('admin_loans'))
 
-    loan.status = 'returned'
-    loan.return_date = datetime.now()
-
-    if book:
-        book.available_copies += 1
-
+    # Копия достается первому в очереди на книгу, если очередь есть
+    promoted_hold_id = circulation.release_copy(session, book_id)
     session.commit()
 
-    flash(f'Книга "{loan.book.title}" отмечена как возвращенная', 'success')
+    book = session.get(Book, book_id)
+    flash(f'Книга "{book.title if book else book_id}" отмечена как возвращенная', 'success')
+    if promoted_hold_id is not None:
+        flash(f'Копия отложена по резервации #{promoted_hold_id} из очереди', 'info')
     return redirect(url_for('admin_loans'))
 
 
@@ -502,9 +815,9 @@ def admin_loan_detail(loan_id):
     """Детальная информация о выдаче"""
     session = create_session()
 
-    loan = session.query(Loan).get(loan_id)
+    loan = session.query(Loan).options(joinedload(Loan.reader), joinedload(Loan.book)).get(loan_id)
 
-    related_reservations = session.query(Reservation).filter_by(
+    related_reservations = session.query(Reservation).options(joinedload(Reservation.reader)).filter_by(
         book_id=loan.book_id,
         status='pending'
     ).order_by(Reservation.reservation_date.desc()).all()
@@ -523,19 +836,20 @@ def admin_reservations():
     status_filter = request.args.get('status', 'pending')
     page = request.args.get('page', 1, type=int)
 
-    query = session.query(Reservation).join(User).join(Book)
-    all_reservations = paginate(query.order_by(Reservation.reservation_date.desc()), page=page,
-                                per_page=len(session.query(Reservation).all())+1)
+    query = session.query(Reservation).join(Reservation.reader).join(Reservation.book).options(
+        contains_eager(Reservation.reader), contains_eager(Reservation.book)
+    )
 
     if status_filter != 'all':
         query = query.filter(Reservation.status == status_filter)
 
-    reservations = paginate(query.order_by(Reservation.reservation_date.desc()), page=page, per_page=20)
+    reservations = keyset_paginate(query, Reservation.reservation_date, Reservation.id,
+                                   cursor=request.args.get('cursor'), page=page, per_page=20)
 
     return render_template('admin/reservations.html',
                            reservations=reservations,
                            status_filter=status_filter,
-                           all_reservations=all_reservations)
+                           reservation_stats=stats.reservation_stats(session))
 
 
 @app.route('/admin/reservations/<int:reservation_id>/fulfill', methods=['POST'])
@@ -544,31 +858,30 @@ def admin_fulfill_reservation(reservation_id):
     """Выполнить резервацию (выдать книгу)"""
     session = create_session()
 
-    reservation = session.query(Reservation).get(reservation_id)
-    book = session.query(Book).get(reservation.book_id)
-
-    if reservation.status != 'pending':
+    closed = circulation.close_reservation(session, reservation_id, 'fulfilled')
+    if closed is None:
         flash('Резервация уже обработана', 'warning')
         return redirect(url_for('admin_reservations'))
-    if book.available_copies == 0 and book.reserved_copies == 0:
+
+    reader_id, book_id = closed
+    # Резервации из старых баз могли не учитываться в reserved_copies: тогда выдаем доступную копию
+    if not (circulation.checkout_reserved_copy(session, book_id) or circulation.checkout_copy(session, book_id)):
+        session.rollback()
         flash('Книга недоступна для выдачи', 'danger')
         return redirect(url_for('admin_reservations'))
 
     loan = Loan(
-        reader_id=reservation.reader_id,
-        book_id=reservation.book_id,
+        reader_id=reader_id,
+        book_id=book_id,
         due_date=datetime.now() + timedelta(days=14),
         loan_date=datetime.now(),
         status='active'
     )
 
-    reservation.status = 'fulfilled'
-
-    book.reserved_copies -= 1
-
     session.add(loan)
     session.commit()
 
+    book = session.get(Book, book_id)
     flash(f'Книга "{book.title}" выдана по резервации', 'success')
     return redirect(url_for('admin_reservations'))
 
@@ -579,15 +892,16 @@ def admin_cancel_reservation(reservation_id):
     """Отменить резервацию"""
     session = create_session()
 
-    reservation = session.query(Reservation).get(reservation_id)
-
-    if reservation.status != 'pending':
+    closed = circulation.close_reservation(session, reservation_id, 'cancelled')
+    if closed is not None:
+        # Отложенная копия уходит следующему в очереди или снова доступна, как и при истечении резервации
+        circulation.release_reserved_copy(session, closed[1])
+    else:
+        closed = circulation.close_reservation(session, reservation_id, 'cancelled', from_status='waiting')
+    if closed is None:
         flash('Резервация уже обработана', 'warning')
         return redirect(url_for('admin_reservations'))
 
-    reservation.status = 'cancelled'
-    reservation.notes = request.form.get('notes', '')
-
     session.commit()
 
     flash('Резервация отменена', 'success')
@@ -604,7 +918,6 @@ def admin_books():
     page = request.args.get('page', 1, type=int)
 
     query = session.query(Book)
-    all_books = paginate(query.order_by(Book.title), page=page, per_page=len(session.query(Book).all())+1)
 
     if search:
         query = query.filter(
@@ -617,7 +930,7 @@ def admin_books():
 
     books = paginate(query.order_by(Book.title), page=page, per_page=20)
 
-    return render_template('admin/books.html', books=books, search=search, all_books=all_books)
+    return render_template('admin/books.html', books=books, search=search, book_stats=stats.book_stats(session))
 
 
 @app.route('/admin/books/<int:book_id>')
@@ -628,24 +941,30 @@ def admin_book_detail(book_id):
 
     book = session.query(Book).get(book_id)
 
-    active_loans = session.query(Loan).filter_by(
+    active_loans = session.query(Loan).options(joinedload(Loan.reader)).filter_by(
         book_id=book_id,
         status='active'
     ).order_by(Loan.due_date).all()
 
-    active_reservations = session.query(Reservation).filter_by(
+    active_reservations = session.query(Reservation).options(joinedload(Reservation.reader)).filter_by(
         book_id=book_id,
         status='pending'
     ).order_by(Reservation.reservation_date.desc()).all()
 
-    loan_history = session.query(Loan).filter_by(book_id=book_id).order_by(
+    loan_history = session.query(Loan).options(joinedload(Loan.reader)).filter_by(book_id=book_id).order_by(
         Loan.loan_date.desc()
     ).limit(50).all()
 
+    waiting_queue = session.query(Reservation).options(joinedload(Reservation.reader)).filter_by(
+        book_id=book_id,
+        status='waiting'
+    ).order_by(Reservation.id).all()
+
     return render_template('admin/book_detail.html',
                            book=book,
                            active_loans=active_loans,
                            active_reservations=active_reservations,
+                           waiting_queue=waiting_queue,
                            loan_history=loan_history)
 
 
@@ -661,6 +980,7 @@ def toggle_admin(user_id):
     user = session.query(User).get(user_id)
     user.is_admin = not user.is_admin
     session.commit()
+    user_cache.invalidate(user_id)
 
     return jsonify({'success': True, 'is_admin': user.is_admin})
 
@@ -678,6 +998,7 @@ def deactivate_user(user_id):
     user = session.query(User).get(user_id)
     user.is_active = not user.is_active
     session.commit()
+    user_cache.invalidate(user_id)
 
     action = "активирован" if user.is_active else "деактивирован"
     flash(f'Пользователь {user.full_name} {action}', 'success')
@@ -702,15 +1023,123 @@ def extend_loan(loan_id):
         return jsonify({'success': False, 'message': str(e)}), 400
 
 
+def batch_response(results):
+    succeeded = sum(result['ok'] for result in results)
+    return jsonify({'results': results, 'succeeded': succeeded, 'failed': len(results) - succeeded})
+
+
+def batch_data(data):
+    """Тело JSON-запроса пакетной операции; ValueError, если это не объект"""
+    if not isinstance(data, dict):
+        raise ValueError('Нужен JSON-объект')
+    return data
+
+
+def batch_items(data, key):
+    """Список элементов пакета из JSON-запроса; ValueError, если он пуст или слишком велик"""
+    items = batch_data(data).get(key)
+    if not isinstance(items, list) or not items:
+        raise ValueError(f'Нужен непустой список {key}')
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValueError(f'Не больше {MAX_BATCH_SIZE} элементов в пакете')
+    return items
+
+
+def batch_due_date(data, default_days=None):
+    """Срок возврата из JSON-запроса (ГГГГ-ММ-ДД); ValueError, если он не указан или уже прошел"""
+    value = batch_data(data).get('due_date')
+    if value is None and default_days is not None:
+        return (datetime.now() + timedelta(days=default_days)).date()
+    if not isinstance(value, str):
+        raise ValueError('Нужна дата due_date в формате ГГГГ-ММ-ДД')
+    due_date = datetime.strptime(value, '%Y-%m-%d').date()
+    if due_date < datetime.now().date():
+        raise ValueError('Срок возврата не может быть в прошлом')
+    return due_date
+
+
+@app.route('/admin/loans/batch/checkout', methods=['POST'])
+@admin_required
+def batch_checkout():
+    """Пакетная выдача: {"items": [{"user_id": 1, "book_id": 2}, ...], "due_date": "ГГГГ-ММ-ДД"}"""
+    data = request.get_json(silent=True)
+    try:
+        items = [(int(item['user_id']), int(item['book_id'])) for item in batch_items(data, 'items')]
+        due_date = batch_due_date(data, default_days=14)
+    except (ValueError, TypeError, KeyError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    session = create_session()
+    results = circulation.checkout_many(session, items, due_date)
+    session.commit()
+    return batch_response(results)
+
+
+@app.route('/admin/loans/batch/return', methods=['POST'])
+@admin_required
+def batch_return():
+    """Пакетный возврат: {"loan_ids": [1, 2, ...]}"""
+    try:
+        loan_ids = [int(loan_id) for loan_id in batch_items(request.get_json(silent=True), 'loan_ids')]
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    session = create_session()
+    results = circulation.return_many(session, loan_ids)
+    session.commit()
+    return batch_response(results)
+
+
+@app.route('/admin/loans/batch/extend', methods=['POST'])
+@admin_required
+def batch_extend():
+    """Пакетное продление: {"loan_ids": [1, 2, ...], "due_date": "ГГГГ-ММ-ДД"}"""
+    data = request.get_json(silent=True)
+    try:
+        loan_ids = [int(loan_id) for loan_id in batch_items(data, 'loan_ids')]
+        due_date = batch_due_date(data)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    session = create_session()
+    results = circulation.extend_many(session, loan_ids, due_date)
+    session.commit()
+    return batch_response(results)
+
+
+@app.route('/admin/export/<kind>')
+@admin_required
+def admin_export(kind):
+    """Потоковая выгрузка выдач, резерваций, пользователей или книг в CSV/JSONL.
+
+    Параметры: format (csv, jsonl), status, from и to (ГГГГ-ММ-ДД, включительно).
+    Читает сессией только для чтения, поэтому медленная загрузка не держит блокировку записи.
+    """
+    export_format = request.args.get('format', 'csv')
+    try:
+        chunks = export.iter_export(
+            create_read_session(), kind, export_format,
+            status=request.args.get('status'),
+            date_from=export.parse_date(request.args.get('from'), 'from'),
+            date_to=export.parse_date(request.args.get('to'), 'to'),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    response = stream_response(chunks, export.FORMATS[export_format])
+    filename = f'{kind}-{datetime.now().date().isoformat()}.{export_format}'
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 @app.route('/admin/books/create', methods=['GET', 'POST'])
 @admin_required
 def admin_create_book():
     """Создание новой книги"""
     session = create_session()
 
-    popular_authors = session.query(Book.author).distinct().limit(20).all()
-    popular_genres = session.query(Book.genre).distinct().limit(20).all()
-    popular_publishers = session.query(Book.publisher).distinct().limit(20).all()
+    suggest_index.ensure_loaded()
+    popular = suggest_index.suggest('', ('author', 'genre', 'publisher'))
 
     if request.method == 'POST':
         try:
@@ -727,6 +1156,7 @@ def admin_create_book():
 
             session.add(book)
             session.commit()
+            suggest_index.book_changed(book.id, new=book_values(book))
 
             flash(f'Книга "{book.title}" успешно добавлена', 'success')
             return redirect(url_for('admin_book_detail', book_id=book.id))
@@ -735,9 +1165,9 @@ def admin_create_book():
             flash(f'Ошибка при создании книги: {str(e)}', 'danger')
 
     return render_template('admin/create_book.html',
-                           popular_authors=[a[0] for a in popular_authors if a[0]],
-                           popular_genres=[g[0] for g in popular_genres if g[0]],
-                           popular_publishers=[p[0] for p in popular_publishers if p[0]],
+                           popular_authors=[value for value, weight in popular['author']],
+                           popular_genres=[value for value, weight in popular['genre']],
+                           popular_publishers=[value for value, weight in popular['publisher']],
                            current_year=datetime.now().year)
 
 
@@ -750,6 +1180,7 @@ def admin_edit_book(book_id):
     book = session.query(Book).get(book_id)
 
     if request.method == 'POST':
+        old_values = book_values(book)
         try:
             book.title = request.form['title']
             book.author = request.form['author']
@@ -760,9 +1191,15 @@ def admin_edit_book(book_id):
             book.available_copies = int(request.form['available_copies'])
             book.location = request.form.get('location')
             book.description = request.form.get('description')
+            session.flush()
+            # Добавленные копии сначала достаются очереди, а не новым резервациям
+            promoted = circulation.serve_waiting_holds(session, [book.id])[book.id]
 
             session.commit()
+            suggest_index.book_changed(book.id, old_values, book_values(book))
             flash(f'Книга "{book.title}" успешно обновлена', 'success')
+            if promoted:
+                flash(f'Копии отложены первым в очереди: {promoted}', 'info')
             return redirect(url_for('admin_book_detail', book_id=book.id))
         except Exception as e:
             flash(f'Ошибка при обновлении книги: {str(e)}', 'danger')
@@ -789,6 +1226,7 @@ def admin_delete_book(book_id):
 
     session.delete(book)
     session.commit()
+    suggest_index.book_changed(book_id, old=book_values(book))
 
     flash(f'Книга "{book.title}" успешно удалена', 'success')
     return redirect(url_for('admin_books'))
@@ -801,6 +1239,54 @@ def logout():
     return redirect('/')
 
 
+@app.cli.command('migrate')
+def migrate_command():
+    """Применить миграции схемы (flask --app main migrate); то же выполняется при запуске"""
+    global_init(DB_FILE)
+    print(f'Версия схемы: {migrations.current_version(get_engine())}')
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Перестроить полнотекстовый индекс книг (flask --app main rebuild-search-index)"""
+    global_init(DB_FILE)
+    search.rebuild_search_index(get_engine())
+    print('Поисковый индекс перестроен')
+
+
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(list(export.EXPORTS)))
+@click.option('--format', 'export_format', type=click.Choice(list(export.FORMATS)), default='csv')
+@click.option('--status', help='статус записей (all - все)')
+@click.option('--from', 'date_from', help='с даты ГГГГ-ММ-ДД включительно')
+@click.option('--to', 'date_to', help='по дату ГГГГ-ММ-ДД включительно')
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help='файл (по умолчанию stdout)')
+def export_command(kind, export_format, status, date_from, date_to, output):
+    """Выгрузить таблицу в CSV/JSONL (flask --app main export loans --status overdue -o loans.csv)"""
+    # Сообщение о подключении - в stderr, чтобы не попасть в выгрузку при выводе в stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        global_init(DB_FILE)
+    try:
+        chunks = export.iter_export(create_read_session(), kind, export_format, status=status,
+                                    date_from=export.parse_date(date_from, '--from'),
+                                    date_to=export.parse_date(date_to, '--to'))
+        for chunk in chunks:
+            output.write(chunk)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    finally:
+        remove_session()
+
+
+@app.cli.command('rebuild-facets')
+def rebuild_facets_command():
+    """Пересчитать счетчики фасетов каталога (flask --app main rebuild-facets)"""
+    global_init(DB_FILE)
+    with get_engine().begin() as conn:
+        facets.rebuild_facets(conn)
+    print('Счетчики фасетов пересчитаны')
+
+
 @app.template_filter('dateequalto')
 def date_equal_to_filter(value, compare_date):
     """Проверяет, равна ли дата другой дате"""
@@ -824,11 +1310,19 @@ def inject_common_data():
 
 
 if __name__ == '__main__':
-    global_init('db/database.db')
+    create_app(DevelopmentConfig)
     create_users()
 
     session = create_session()
     if len(session.query(Book).all()) == 0:
         populate_books_table()
+        # Индекс подсказок загружен create_app еще по пустой базе
+        suggest_index.refresh_async()
+
+    # Просрочка выдач и истечение резерваций выполняются в фоне, а не при открытии админ-панели.
+    # В режиме отладки запускаем планировщик только в дочернем процессе перезагрузчика.
+    if app.config['SCHEDULER_ENABLED'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        Scheduler().start()
 
-    app.run('127.0.0.1', 500, debug=True)
+    # Сервер разработки: один процесс с отладчиком. Боевой запуск - wsgi.py
+    app.run(app.config['HOST'], app.config['PORT'], debug=app.config['DEBUG'])
@@ -0,0 +1,198 @@
+"""Боевой запуск: N рабочих процессов (prefork), в каждом пул из T потоков.
+
+    LIBRARY_SECRET_KEY=... python wsgi.py --workers 4 --threads 8 --port 8000
+
+Родитель один раз создает приложение (миграции базы, индекс подсказок), открывает
+слушающий сокет и порождает рабочие процессы через fork; каждый из них сразу после fork
+сбрасывает унаследованные пулы соединений SQLite (db_session.dispose_engines) и открывает
+свои, а индекс подсказок получает готовым.
+Занятый всеми потоками процесс не принимает новые соединения - их разбирают свободные.
+Упавший рабочий процесс перезапускается; SIGTERM или Ctrl+C дожидаются текущих запросов.
+Фоновые задачи выполняются в отдельном процессе-планировщике (SCHEDULER_ENABLED).
+
+Настройки - config.ProductionConfig (отладчик выключен), значения по умолчанию берутся
+из переменных окружения LIBRARY_DB, LIBRARY_HOST, LIBRARY_PORT, LIBRARY_WORKERS,
+LIBRARY_THREADS, LIBRARY_USER_CACHE_TTL.
+
+Состояние в памяти у каждого рабочего процесса свое:
+  - кэш пользователей load_user по умолчанию выключен (USER_CACHE_TTL = 0): сброс записи
+    после блокировки пользователя или снятия прав администратора действует только в одном
+    процессе, а остальные пускали бы его со старыми правами до истечения срока записи;
+  - /admin/metrics и /admin/metrics/prometheus показывают счетчики того процесса, который
+    ответил на запрос; серии Prometheus помечены меткой pid, суммировать их нужно на
+    стороне сборщика. Оба адреса требуют сессии администратора, так что сборщику нужна
+    ее cookie.
+
+Приложение можно запустить и другим WSGI-сервером с prefork-моделью. Приложение нужно
+создавать в родителе до fork (у gunicorn - --preload): иначе create_app выполнится в каждом
+рабочем процессе, и они одновременно начнут миграции одной базы (ALTER TABLE, запись в
+schema_migrations) и каждый построит свой индекс подсказок. Фоновые задачи (просрочка
+выдач, истечение резерваций) такой сервер не запустит - их нужно запускать отдельным
+процессом:
+
+    gunicorn --preload -w 4 --threads 8 -b 0.0.0.0:8000 'main:create_app("production")'
+    python -m data.scripts.scheduler --db db/database.db
+
+На платформах без fork (Windows) запускается один процесс с пулом потоков.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+
+from werkzeug.serving import BaseWSGIServer
+
+from config import ProductionConfig
+from data.db_models.db_session import dispose_engines
+from main import create_app
+
+# Очередь соединений слушающего сокета
+BACKLOG = 1024
+# Не перезапускать рабочие процессы чаще (если они падают сразу после старта)
+RESPAWN_DELAY_SECONDS = 1
+
+
+class PooledWSGIServer(ThreadingMixIn, BaseWSGIServer):
+    """Сервер werkzeug, обрабатывающий соединения в пуле из threads потоков.
+
+    Пока все потоки заняты, сервер не принимает соединения (accept), и их забирают
+    другие рабочие процессы, слушающие тот же сокет.
+    """
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None):
+        super().__init__(host, port, app, fd=fd)
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+        self._slots = threading.BoundedSemaphore(threads)
+        if fd is not None:
+            # Соединение, которое забрал другой процесс, не должно блокировать accept
+            self.socket.setblocking(False)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        self._executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+    def serve_forever(self, poll_interval=0.5):
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            # Сокет уже закрыт: дожидаемся запросов, которые еще обрабатываются
+            self._executor.shutdown(wait=True)
+
+
+def serve_worker(app, sock, threads):
+    """Цикл рабочего процесса; SIGTERM останавливает прием соединений, текущие запросы завершаются"""
+    server = PooledWSGIServer(*sock.getsockname()[:2], app, threads, fd=sock.fileno())
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server.serve_forever()
+
+
+def run_scheduler():
+    from data.scripts.scheduler import Scheduler
+
+    scheduler = Scheduler()
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    scheduler.start()
+    stopped.wait()
+    scheduler.stop()
+
+
+def spawn(target, *args):
+    """Дочерний процесс, выполняющий target(*args); pid"""
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            target(*args)
+        except BaseException:
+            logging.exception('Рабочий процесс завершился с ошибкой')
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def serve(app, host, port, workers, threads):
+    if not hasattr(os, 'fork'):
+        print(f'fork недоступен: один процесс, {threads} потоков, http://{host}:{port}')
+        if app.config['SCHEDULER_ENABLED']:
+            from data.scripts.scheduler import Scheduler
+            Scheduler().start()
+        PooledWSGIServer(host, port, app, threads).serve_forever()
+        return
+
+    sock = socket.create_server((host, port), backlog=BACKLOG)
+    # Родитель сам запросы не обслуживает: его соединения (миграции) закрываются до fork
+    dispose_engines()
+
+    children = {}
+    for _ in range(workers):
+        children[spawn(serve_worker, app, sock, threads)] = 'worker'
+    if app.config['SCHEDULER_ENABLED']:
+        children[spawn(run_scheduler)] = 'scheduler'
+    print(f'{workers} процессов по {threads} потоков, http://{host}:{port}')
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        role = children.pop(pid, None)
+        if role and not stopping:
+            print(f'Процесс {pid} ({role}) завершился с кодом {os.waitstatus_to_exitcode(status)}, перезапуск',
+                  file=sys.stderr)
+            time.sleep(RESPAWN_DELAY_SECONDS)
+            children[spawn(serve_worker, app, sock, threads) if role == 'worker' else spawn(run_scheduler)] = role
+    sock.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Боевой запуск библиотеки: несколько процессов с пулом потоков')
+    parser.add_argument('--host', default=ProductionConfig.HOST)
+    parser.add_argument('--port', type=int, default=ProductionConfig.PORT)
+    parser.add_argument('--workers', type=int, default=ProductionConfig.WORKERS, help='рабочих процессов')
+    parser.add_argument('--threads', type=int, default=ProductionConfig.THREADS, help='потоков в процессе')
+    parser.add_argument('--no-scheduler', action='store_true',
+                        help='не запускать фоновые задачи (они выполняются в другом месте)')
+    parser.add_argument('--access-log', action='store_true', help='писать в stderr строку на каждый запрос')
+    args = parser.parse_args()
+
+    class ServeConfig(ProductionConfig):
+        DB_READ_POOL_SIZE = args.threads
+        SCHEDULER_ENABLED = ProductionConfig.SCHEDULER_ENABLED and not args.no_scheduler
+
+    logging.basicConfig(level=logging.INFO)
+    if not args.access_log:
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    serve(create_app(ServeConfig), args.host, args.port, args.workers, args.threads)